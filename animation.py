@@ -0,0 +1,81 @@
+# (name, frames, duration, loop) -> Clip, sprites with the same clip are animated together
+clips = {}
+
+
+def get_clip(name, frames, duration, loop=True):
+    key = (name, tuple(frames), duration, loop)
+    clip = clips.get(key)
+    if clip is None:
+        clip = clips[key] = Clip(name, frames, duration, loop)
+    return clip
+
+
+class Clip:
+    # A sequence of frames shown duration seconds each. A looping clip's frame only depends on the time, so
+    # all sprites playing it show the same frame. A clip that plays once starts when its sprite is added.
+    def __init__(self, name, frames, duration, loop=True):
+        self.name = name
+        self.frames = list(frames)
+        self.duration = duration
+        self.loop = loop
+
+    def index(self, time):
+        index = int(time / self.duration)
+        return index % len(self.frames) if self.loop else index
+
+    def __repr__(self):
+        return f"Clip({self.name}, {len(self.frames)} frames, {self.duration}s)"
+
+
+class Animator:
+    # Shows the right frame of every sprite's clip from the simulated time. Looping clips are advanced once per
+    # clip, their sprites are only touched when the frame changes. Sprites whose clip plays once get
+    # on_clip_end() called when it is over.
+    def __init__(self):
+        self.time = 0.0
+        # Looping clip -> {sprite: None}, and the frame its sprites show
+        self.looping = {}
+        self.shown = {}
+        # Sprite -> time its clip started, for clips that play once
+        self.once = {}
+
+    def play(self, sprite):
+        clip = sprite.clip
+        if clip.loop:
+            self.looping.setdefault(clip, {})[sprite] = None
+            sprite.image = clip.frames[clip.index(self.time)]
+        else:
+            self.once[sprite] = self.time
+            sprite.image = clip.frames[0]
+
+    def stop(self, sprite):
+        clip = sprite.clip
+        if clip is None:
+            return
+        if clip.loop:
+            sprites = self.looping.get(clip)
+            if sprites:
+                sprites.pop(sprite, None)
+        else:
+            self.once.pop(sprite, None)
+
+    def update(self, dt):
+        self.time += dt
+        for clip, sprites in self.looping.items():
+            index = clip.index(self.time)
+            if index != self.shown.get(clip):
+                self.shown[clip] = index
+                image = clip.frames[index]
+                for sprite in sprites:
+                    sprite.image = image
+        finished = []
+        for sprite, start in self.once.items():
+            clip = sprite.clip
+            index = clip.index(self.time - start)
+            if index >= len(clip.frames):
+                finished.append(sprite)
+            else:
+                sprite.image = clip.frames[index]
+        for sprite in finished:
+            del self.once[sprite]
+            sprite.on_clip_end()
@@ -0,0 +1,121 @@
+import pygame
+
+
+class AssetCache:
+    # Decodes, converts and scales every image once. Surfaces are cached by (source, size, colorkey, alpha)
+    # where source is a file path or a (sheet path, rect) pair, and are returned in the display format.
+    def __init__(self):
+        self.surfaces = {}
+        # id of a cached surface -> its key, so scaling a cached surface can be cached by its source
+        self.keys = {}
+        # Surfaces that did not come from the cache but were scaled through it, kept alive so ids stay unique
+        self.foreign = {}
+        # key -> loader to use instead of the one passed to get(), see bundle.py
+        self.providers = {}
+        # (frames, size) -> tuple of scaled frames, shared by every sprite animated with them
+        self.frame_sets = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Return the surface cached under key, calling loader() to create it on a miss."""
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self.providers.pop(key, loader)()
+        self.surfaces[key] = surface
+        self.keys[id(surface)] = key
+        return surface
+
+    def provide(self, key, loader):
+        """Create the surface for key with loader when it is first asked for."""
+        self.providers[key] = loader
+
+    def load(self, path, size=None, colorkey=None, alpha=True):
+        """Load an image file. alpha=False drops per pixel alpha like Surface.convert()."""
+        if size:
+            size = tuple(size)
+            return self.get((path, size, colorkey, alpha),
+                            lambda: pygame.transform.scale(self.load(path, None, colorkey, alpha), size))
+        return self.get((path, None, colorkey, alpha),
+                        lambda: self.convert(pygame.image.load(path), colorkey, alpha))
+
+    def subsurface(self, sheet, path, rect, colorkey=None):
+        """Cut rect out of the sheet loaded from path."""
+        rect = pygame.Rect(rect)
+
+        def cut():
+            image = pygame.Surface(rect.size)
+            image.blit(sheet, (0, 0), rect)
+            return self.convert(image, colorkey, False)
+
+        return self.get(((path, tuple(rect)), None, colorkey, False), cut)
+
+    def scale(self, surface, size):
+        """Scale a surface, caching the result by the surface's source when it came from this cache."""
+        size = tuple(size)
+        if surface.get_size() == size:
+            return surface
+        key = self.keys.get(id(surface))
+        if key is None:
+            self.foreign[id(surface)] = surface
+            key = (id(surface), None, None, None)
+        source, _, colorkey, alpha = key
+        return self.get((source, size, colorkey, alpha), lambda: pygame.transform.scale(surface, size))
+
+    def resolve(self, key):
+        """Return the surface for a key of this cache, loading it from its source if it is not cached. Keys of
+        surfaces that were not made from a file cannot be resolved and give None."""
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            return surface
+        source, size, colorkey, alpha = key
+        if isinstance(source, str):
+            return self.load(source, size, colorkey, alpha)
+        if not isinstance(source, tuple):
+            return None
+        path, rect = source
+        # Sprite sheets are loaded without per pixel alpha, see SpriteSheet
+        image = self.subsurface(self.load(path, alpha=False), path, rect, colorkey)
+        return self.scale(image, size) if size else image
+
+    def frames(self, images, size=None):
+        """Scale the frames of an animation to size. The same frames and size always give the same tuple."""
+        key = (tuple(images), tuple(size) if size else None)
+        frames = self.frame_sets.get(key)
+        if frames is None:
+            frames = self.frame_sets[key] = tuple(self.scale(image, size) if size else image for image in images)
+        return frames
+
+    @staticmethod
+    def convert(surface, colorkey=None, alpha=True):
+        # Converting needs a display mode, without one the surface is kept in its loaded format
+        if pygame.display.get_surface():
+            if alpha and surface.get_flags() & pygame.SRCALPHA:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+        if colorkey is not None:
+            if colorkey == -1:
+                colorkey = surface.get_at((0, 0))
+            surface.set_colorkey(colorkey, pygame.RLEACCEL)
+        return surface
+
+    def clear(self):
+        """Forget every cached surface, surfaces already handed out stay valid."""
+        self.surfaces.clear()
+        self.keys.clear()
+        self.foreign.clear()
+        self.frame_sets.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "surfaces": len(self.surfaces)}
+
+    def __repr__(self):
+        return f"AssetCache({self.hits} hits, {self.misses} misses, {len(self.surfaces)} surfaces)"
+
+
+# Shared by every sprite and sprite sheet
+assets = AssetCache()
@@ -0,0 +1,58 @@
+import pygame
+
+
+class BackgroundLayer:
+    # Static tiles baked into a single surface, so the background costs one blit instead of one object per tile
+    def __init__(self, size, color='black'):
+        self.size = size
+        self.color = color
+        self.tiles = []
+        self.surface = None
+        # Regions that have to be rebaked, None means the whole layer
+        self.invalid_rects = None
+
+    def add_tile(self, image, pos):
+        """Add an image centered at pos."""
+        rect = image.get_rect(center=pos)
+        self.tiles.append((image, rect))
+        self.invalidate(rect)
+
+    def clear(self):
+        self.tiles = []
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        """Mark rect, or the whole layer if no rect is given, to be rebaked on the next bake()."""
+        if rect is None or self.surface is None:
+            self.invalid_rects = None
+        elif self.invalid_rects is not None:
+            self.invalid_rects.append(pygame.Rect(rect))
+
+    def bake(self):
+        """Redraw the invalidated regions and return them, so partial redraws know what to repaint."""
+        if self.invalid_rects == []:
+            return []
+        if self.surface is None or self.surface.get_size() != tuple(self.size):
+            self.surface = pygame.Surface(self.size)
+            if pygame.display.get_surface():
+                self.surface = self.surface.convert()
+        if self.invalid_rects is None:
+            rects = [self.surface.get_rect()]
+        else:
+            rects = [rect.clip(self.surface.get_rect()) for rect in self.invalid_rects]
+        for rect in rects:
+            self.surface.set_clip(rect)
+            self.surface.fill(self.color, rect)
+            for image, tile_rect in self.tiles:
+                if tile_rect.colliderect(rect):
+                    self.surface.blit(image, tile_rect)
+        self.surface.set_clip(None)
+        self.invalid_rects = []
+        return rects
+
+    def draw(self, surf, rect=None):
+        """Blit the layer, or only the rect region of it, to surf."""
+        if rect is None:
+            surf.blit(self.surface, (0, 0))
+        else:
+            surf.blit(self.surface, rect, rect)
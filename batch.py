@@ -0,0 +1,146 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pygame
+
+from main import App, generate_level, HIT_ENEMY
+
+# Columns of the per game results
+FIELDS = ("seed", "policy", "score", "ticks", "enemies_killed", "game_over", "seconds", "ms_per_tick_mean",
+          "ms_per_tick_p50", "ms_per_tick_p95", "ms_per_tick_max")
+
+
+def key_event(event_type, key):
+    return pygame.event.Event(event_type, key=key)
+
+
+class RandomPolicy:
+    # Every few ticks presses a random direction or releases it, and fires when it can
+    def __init__(self, rng, change_chance=0.05, fire_chance=0.1):
+        self.rng = rng
+        self.change_chance = change_chance
+        self.fire_chance = fire_chance
+        self.held = None
+
+    def __call__(self, game):
+        inputs = []
+        if self.rng.random() < self.change_chance:
+            if self.held is not None:
+                inputs.append(key_event(pygame.KEYUP, self.held))
+            self.held = self.rng.choice((pygame.K_LEFT, pygame.K_RIGHT, None))
+            if self.held is not None:
+                inputs.append(key_event(pygame.KEYDOWN, self.held))
+        if self.rng.random() < self.fire_chance:
+            inputs.append(key_event(pygame.KEYDOWN, pygame.K_SPACE))
+        return inputs
+
+
+class SweepPolicy:
+    # Sweeps the player from one side of the screen to the other while firing as often as possible
+    def __init__(self, rng, left=80, right=560):
+        self.left = left
+        self.right = right
+        self.held = None
+
+    def __call__(self, game):
+        inputs = [key_event(pygame.KEYDOWN, pygame.K_SPACE)]
+        x = game.player.get_pos()[0]
+        if self.held is None or (self.held == pygame.K_RIGHT and x > self.right) or (
+                self.held == pygame.K_LEFT and x < self.left):
+            if self.held is not None:
+                inputs.append(key_event(pygame.KEYUP, self.held))
+            self.held = pygame.K_LEFT if self.held == pygame.K_RIGHT else pygame.K_RIGHT
+            inputs.append(key_event(pygame.KEYDOWN, self.held))
+        return inputs
+
+
+POLICIES = {"random": RandomPolicy, "sweep": SweepPolicy}
+
+
+def play(seed, policy, max_ticks):
+    """Play one headless game and return its result row."""
+    game = App(headless=True, seed=seed)
+    generate_level(game)
+    # The policy gets its own generator so its choices do not shift the game's random sequence
+    policy = POLICIES[policy](np.random.default_rng(seed))
+    kills = [0]
+    game.events.subscribe(HIT_ENEMY, lambda event: kills.__setitem__(0, kills[0] + 1))
+
+    tick_times = np.empty(max_ticks)
+    start = time.perf_counter()
+    # step() delivers the events of its tick before returning, so the last kill is counted when the loop stops
+    while game.ticks < max_ticks and not game.game_over and not game.level_cleared():
+        inputs = policy(game)
+        tick_start = time.perf_counter()
+        game.step(inputs)
+        tick_times[game.ticks - 1] = time.perf_counter() - tick_start
+    seconds = time.perf_counter() - start
+
+    tick_ms = tick_times[:game.ticks] * 1000
+    return {"seed": seed, "policy": policy.__class__.__name__, "score": game.get_score(), "ticks": game.ticks,
+            "enemies_killed": kills[0], "game_over": game.game_over, "seconds": round(seconds, 4),
+            "ms_per_tick_mean": round(float(tick_ms.mean()), 4) if game.ticks else 0,
+            "ms_per_tick_p50": round(float(np.percentile(tick_ms, 50)), 4) if game.ticks else 0,
+            "ms_per_tick_p95": round(float(np.percentile(tick_ms, 95)), 4) if game.ticks else 0,
+            "ms_per_tick_max": round(float(tick_ms.max()), 4) if game.ticks else 0}
+
+
+def summarize(rows, seconds):
+    summary = {"games": len(rows), "wall_seconds": round(seconds, 3),
+               "ticks_per_second": round(sum(row["ticks"] for row in rows) / seconds, 1) if seconds else 0}
+    for field in ("score", "ticks", "enemies_killed", "ms_per_tick_mean", "ms_per_tick_p95"):
+        values = np.array([row[field] for row in rows], dtype=float)
+        summary[field] = {"mean": round(float(values.mean()), 4), "std": round(float(values.std()), 4),
+                          "min": float(values.min()), "max": float(values.max())}
+    summary["game_over_rate"] = round(sum(row["game_over"] for row in rows) / len(rows), 4)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many headless games in parallel and aggregate the results")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random")
+    parser.add_argument("--ticks", type=int, default=20000, help="maximum simulation steps per game")
+    parser.add_argument("--seed", type=int, default=0, help="game i is played with seed + i")
+    parser.add_argument("--csv", metavar="PATH", help="write one row per game, in order of completion")
+    parser.add_argument("--json", metavar="PATH", help="write every game and the aggregate statistics")
+    args = parser.parse_args(argv)
+
+    rows = []
+    csv_file = open(args.csv, "w", newline="") if args.csv else None
+    writer = csv.DictWriter(csv_file, FIELDS) if csv_file else None
+    if writer:
+        writer.writeheader()
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(play, args.seed + i, args.policy, args.ticks) for i in range(args.games)]
+            # Results are streamed out as games finish, not when the whole batch is done
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                if writer:
+                    writer.writerow(row)
+                    csv_file.flush()
+                print(f"[{len(rows)}/{args.games}] seed {row['seed']}: score {row['score']}, "
+                      f"{row['ticks']} ticks, {row['ms_per_tick_mean']:.3f} ms/tick", file=sys.stderr)
+    finally:
+        if csv_file:
+            csv_file.close()
+    summary = summarize(rows, time.perf_counter() - start)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"summary": summary, "games": sorted(rows, key=lambda row: row["seed"])}, file, indent=2)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
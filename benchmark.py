@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+# Rendering is measured without a window, the dummy driver still goes through the display surface
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+from assets import assets
+from spritesheet import SpriteSheet
+from main import App, Enemy, EnemyBullet, Obstacle, Player, get_sprite_images, sprite_sheet_img
+
+SIZES = (50, 200, 1000, 5000, 10000)
+BENCHMARKS = ("move", "integrate", "collisions", "remove", "draw", "load_grid_images")
+
+
+def build(count, seed=0):
+    """An App with count sprites, a third each of enemies, enemy bullets and obstacles. Enemies fill the top of
+    the screen, bullets fall through the middle and obstacles line the bottom, so nothing collides yet and
+    every scenario can be repeated."""
+    rng = np.random.default_rng(seed)
+    game = App(seed=seed)
+    images = get_sprite_images()
+    game.add(Player(image=images[4], pos=(320, 790), size=(32, 32)))
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            sprite = Enemy(image=images[0], pos=(rng.uniform(0, 640), rng.uniform(40, 300)), size=(32, 32),
+                           images=[images[0], images[1]])
+        elif kind == 1:
+            sprite = EnemyBullet((rng.uniform(0, 640), rng.uniform(320, 500)))
+        else:
+            sprite = Obstacle(image=images[10], pos=(rng.uniform(0, 640), rng.uniform(620, 760)), size=(64, 64))
+        game.add(sprite)
+    return game
+
+
+def measure(run, rounds, warmup=2, setup=None):
+    """Seconds taken by each of rounds calls of run(), after warmup calls. setup() is called untimed before
+    each call."""
+    times = []
+    for i in range(warmup + rounds):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return times
+
+
+def bench_move(game, rounds):
+    objects = list(game.objects)
+    dt = game.dt
+
+    def run():
+        for obj in objects:
+            obj.move(dt)
+
+    return measure(run, rounds)
+
+
+def bench_integrate(game, rounds):
+    return measure(lambda: game.store.integrate(game.dt), rounds)
+
+
+def bench_collisions(game, rounds):
+    return measure(game.check_collisions, rounds)
+
+
+def bench_remove(game, rounds):
+    # Takes a tenth of the bullets out and puts them back, as bullets do when they hit or leave the screen
+    bullets = list(game.objects_tag_dict["EnemyBullet"])
+    churn = bullets[:max(1, len(bullets) // 10)]
+
+    def run():
+        for bullet in churn:
+            game.remove(bullet)
+        game.flush_removals()
+        for bullet in churn:
+            game.add(bullet)
+
+    return measure(run, rounds)
+
+
+def bench_draw(game, rounds):
+    # Every frame draws the sprites one step further along
+    return measure(game.draw, rounds, setup=lambda: game.store.integrate(game.dt))
+
+
+def bench_load_grid_images(rounds):
+    # A cold start, the cache is emptied so the sheet is decoded and cut up again every time
+    def run():
+        SpriteSheet(sprite_sheet_img).load_grid_images(5, 7)
+
+    return measure(run, rounds, setup=assets.clear)
+
+
+def summarize(times, count=None):
+    ms = [t * 1000 for t in times]
+    result = {"median_ms": round(statistics.median(ms), 4), "min_ms": round(min(ms), 4),
+              "mean_ms": round(statistics.fmean(ms), 4), "rounds": len(ms)}
+    if count:
+        result["us_per_sprite"] = round(result["median_ms"] * 1000 / count, 4)
+    return result
+
+
+def run_benchmarks(sizes, names, rounds):
+    results = {}
+    # Images are converted to the display format, as in the game
+    pygame.init()
+    pygame.display.set_mode((640, 800))
+    if "load_grid_images" in names:
+        results["load_grid_images"] = summarize(bench_load_grid_images(rounds))
+        print(f"load_grid_images: {results['load_grid_images']['median_ms']:.3f} ms", file=sys.stderr)
+    for count in sizes:
+        for name in names:
+            if name == "load_grid_images":
+                continue
+            # Each benchmark gets its own scenario so none sees the state another left behind
+            game = build(count)
+            results[f"{name}/{count}"] = summarize(globals()[f"bench_{name}"](game, rounds), count)
+            print(f"{name}/{count}: {results[f'{name}/{count}']['median_ms']:.3f} ms", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print each result next to its baseline and return the names of those that are more than threshold
+    (a fraction) slower."""
+    regressions = []
+    print(f"{'benchmark':<24} {'baseline ms':>12} {'median ms':>12} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<24} {'-':>12} {result['median_ms']:12.3f} {'new':>8}")
+            continue
+        change = result["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        flag = " REGRESSION" if change > threshold else ""
+        print(f"{name:<24} {base['median_ms']:12.3f} {result['median_ms']:12.3f} {change:+8.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the engine hot paths with growing numbers of sprites")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="sprite counts to run")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run")
+    parser.add_argument("--rounds", type=int, default=20, help="timed calls per benchmark")
+    parser.add_argument("--output", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against results written with --output")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction a median may be slower than its baseline before it counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.only, args.rounds)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"python": platform.python_version(), "pygame": pygame.version.ver,
+                       "numpy": np.__version__, "machine": platform.machine(), "results": results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for name, result in results.items():
+            print(f"{name:<24} {result['median_ms']:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
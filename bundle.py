@@ -0,0 +1,80 @@
+import json
+import os
+
+import numpy as np
+import pygame
+
+from assets import AssetCache, assets
+
+# Bundle file layout: an .npz with a "manifest" entry, a JSON document listing every surface and the files they
+# were made from, and one uint8 array of raw pixels per surface named in the manifest.
+VERSION = 1
+
+
+def as_key(value):
+    # JSON turns the tuples of cache keys into lists
+    return tuple(as_key(item) for item in value) if isinstance(value, list) else value
+
+
+def source_path(key):
+    source = key[0]
+    return source[0] if isinstance(source, tuple) else source
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def intermediate(key, cache):
+    # An image file loaded only to be scaled, once the scaled surfaces come from the bundle it is never asked for
+    source, size, colorkey, alpha = key
+    return size is None and isinstance(source, str) and any(
+        other[0] == source and other[1] is not None and other[2:] == (colorkey, alpha) for other in cache.surfaces)
+
+
+def build_bundle(path, cache=assets):
+    """Write every surface in cache that was made from a file to path, as raw pixels, except the files that were
+    only loaded to be scaled. Returns the number of surfaces written."""
+    entries = []
+    arrays = {}
+    sources = {}
+    for key, surface in cache.surfaces.items():
+        source = source_path(key)
+        if not isinstance(source, str) or intermediate(key, cache):
+            continue
+        fmt = "RGBA" if surface.get_flags() & pygame.SRCALPHA else "RGB"
+        name = f"s{len(entries)}"
+        arrays[name] = np.frombuffer(pygame.image.tobytes(surface, fmt), dtype=np.uint8)
+        colorkey = surface.get_colorkey()
+        entries.append({"key": key, "name": name, "size": surface.get_size(), "format": fmt,
+                        "colorkey": tuple(colorkey) if colorkey else None})
+        sources[source] = source_stamp(source)
+    manifest = {"version": VERSION, "sources": sources, "surfaces": entries}
+    with open(path, "wb") as file:
+        np.savez(file, manifest=np.frombuffer(json.dumps(manifest).encode(), dtype=np.uint8), **arrays)
+    return len(entries)
+
+
+def load_bundle(path, cache=assets):
+    """Let cache take its surfaces from the bundle at path instead of decoding and scaling image files. Nothing
+    is read until a surface is first asked for. Returns the number of surfaces provided, or 0 if the bundle is
+    out of date with its source files."""
+    bundle = np.load(path)
+    manifest = json.loads(bundle["manifest"].tobytes())
+    if manifest["version"] != VERSION:
+        return 0
+    for source, stamp in manifest["sources"].items():
+        if not os.path.exists(source) or source_stamp(source) != stamp:
+            print(f"{path} is out of date with {source}, rebuild it with --build-bundle")
+            return 0
+    for entry in manifest["surfaces"]:
+        cache.provide(as_key(entry["key"]), lambda entry=entry: surface_from(bundle, entry))
+    return len(manifest["surfaces"])
+
+
+def surface_from(bundle, entry):
+    surface = pygame.image.frombuffer(bundle[entry["name"]], tuple(entry["size"]), entry["format"])
+    colorkey = tuple(entry["colorkey"]) if entry["colorkey"] else None
+    # Without a display the surface keeps sharing the array's memory, converting copies it to the display format
+    return AssetCache.convert(surface, colorkey, entry["key"][3] is not False)
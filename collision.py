@@ -0,0 +1,124 @@
+import numpy as np
+import pygame
+
+# Masks shared by every user, see surface_mask(), rect_mask() and circle_mask()
+masks = {}
+
+
+def surface_mask(surface):
+    """Mask of the opaque pixels of surface, which must not be drawn into afterwards. Copy it before changing it."""
+    key = ("surface", surface)
+    mask = masks.get(key)
+    if mask is None:
+        mask = masks[key] = pygame.mask.from_surface(surface)
+    return mask
+
+
+def rect_mask(size):
+    key = ("rect", tuple(size))
+    mask = masks.get(key)
+    if mask is None:
+        mask = masks[key] = pygame.mask.Mask(size, fill=True)
+    return mask
+
+
+def circle_mask(radius):
+    """Mask of the pixels pygame.draw.circle() fills for a circle of radius centered at (radius, radius)."""
+    key = ("circle", radius)
+    mask = masks.get(key)
+    if mask is None:
+        surface = pygame.Surface((2 * radius + 1, 2 * radius + 1))
+        surface.set_colorkey((0, 0, 0))
+        pygame.draw.circle(surface, (255, 255, 255), (radius, radius), radius)
+        mask = masks[key] = pygame.mask.from_surface(surface)
+    return mask
+
+
+class CollisionEngine:
+    # Finds every overlapping pair between two tag groups of an EntityStore. The collision bounds are hashed into
+    # a uniform grid with a few NumPy operations, and only boxes sharing a cell are tested against each other,
+    # with one vectorised AABB test over all of those candidate pairs. Small groups skip the grid and test every
+    # pair at once.
+    def __init__(self, store, cell_size=64, dense_limit=4096):
+        self.store = store
+        # Cells are at least as large as the largest box, so a box touches at most 2 x 2 cells
+        self.cell_size = cell_size
+        # Largest number of pairs tested without the grid
+        self.dense_limit = dense_limit
+
+    def bounds(self, tag=None):
+        """Slots of the live rows with tag, or of all live rows, and their collision bounds as
+        (slots, left, top, right, bottom)."""
+        store = self.store
+        slots = np.flatnonzero(store.mask(tag) if tag is not None else store.alive[:store.count])
+        center = store.position[slots]
+        half = store.collision_size[slots] / 2
+        low = center - half
+        high = center + half
+        return slots, low[:, 0], low[:, 1], high[:, 0], high[:, 1]
+
+    @staticmethod
+    def cells(left, top, right, bottom, cell):
+        """(cell key, box index) for every cell each box touches, sorted by cell key."""
+        x0 = np.floor(left / cell).astype(np.int64)
+        y0 = np.floor(top / cell).astype(np.int64)
+        x1 = np.floor(right / cell).astype(np.int64)
+        y1 = np.floor(bottom / cell).astype(np.int64)
+        index = np.arange(left.size)
+        keys = []
+        boxes = []
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            touches = (x0 + dx <= x1) & (y0 + dy <= y1)
+            # Column in the high bits and row in the low bits, rows are small enough not to carry into the column
+            keys.append((((x0 + dx) << 32) + (y0 + dy))[touches])
+            boxes.append(index[touches])
+        keys = np.concatenate(keys)
+        boxes = np.concatenate(boxes)
+        order = np.argsort(keys, kind="stable")
+        return keys[order], boxes[order]
+
+    def candidates(self, bounds_a, bounds_b):
+        """Indices (i, j) of the box pairs of the two groups that share a grid cell, each pair once, sorted."""
+        extent = max(float(np.max(bounds_a[2] - bounds_a[0])), float(np.max(bounds_a[3] - bounds_a[1])),
+                     float(np.max(bounds_b[2] - bounds_b[0])), float(np.max(bounds_b[3] - bounds_b[1])))
+        cell = max(self.cell_size, extent)
+        keys_a, boxes_a = self.cells(*bounds_a, cell)
+        keys_b, boxes_b = self.cells(*bounds_b, cell)
+        low = np.searchsorted(keys_b, keys_a, "left")
+        counts = np.searchsorted(keys_b, keys_a, "right") - low
+        total = int(counts.sum())
+        if not total:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        i = np.repeat(boxes_a, counts)
+        # Position in keys_b of every candidate: its run of equal keys starts at low, the arange counts through it
+        starts = np.cumsum(counts) - counts
+        j = boxes_b[np.repeat(low - starts, counts) + np.arange(total)]
+        # Boxes sharing several cells are found once per cell
+        pairs = np.unique(i * bounds_b[0].size + j)
+        return pairs // bounds_b[0].size, pairs % bounds_b[0].size
+
+    def query_rect(self, rect, tag=None):
+        """Owners, optionally only those with tag, whose collision rect overlaps rect, ordered by slot."""
+        slots, left, top, right, bottom = self.bounds(tag)
+        hit = (left < rect.right) & (rect.left < right) & (top < rect.bottom) & (rect.top < bottom)
+        owners = self.store.owners
+        return [owners[slot] for slot in slots[hit].tolist()]
+
+    def overlaps(self, tag_a, tag_b):
+        """All overlapping (a, b) owner pairs, ordered by a's then b's slot."""
+        slots_a, left_a, top_a, right_a, bottom_a = self.bounds(tag_a)
+        slots_b, left_b, top_b, right_b, bottom_b = self.bounds(tag_b)
+        if not slots_a.size or not slots_b.size:
+            return []
+        owners = self.store.owners
+        if slots_a.size * slots_b.size <= self.dense_limit:
+            hit = ((left_a[:, None] < right_b) & (left_b < right_a[:, None])
+                   & (top_a[:, None] < bottom_b) & (top_b < bottom_a[:, None]))
+            i, j = np.nonzero(hit)
+        else:
+            i, j = self.candidates((left_a, top_a, right_a, bottom_a), (left_b, top_b, right_b, bottom_b))
+            hit = ((left_a[i] < right_b[j]) & (left_b[j] < right_a[i])
+                   & (top_a[i] < bottom_b[j]) & (top_b[j] < bottom_a[i]))
+            i = i[hit]
+            j = j[hit]
+        return [(owners[a], owners[b]) for a, b in zip(slots_a[i].tolist(), slots_b[j].tolist())]
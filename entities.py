@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class EntityStore:
+    # Keeps the position, velocity and sizes of every sprite in contiguous arrays so movement and bounds checks
+    # are a few NumPy operations per step instead of one small operation per sprite.
+    # Sprites are views into their row, see Sprite.position.
+    columns = ("position", "previous_position", "velocity", "size", "collision_size", "alive", "cull_outside", "tag")
+
+    def __init__(self, capacity=256, detached=False):
+        self.capacity = capacity
+        # A detached store holds the rows of sprites that are in no App and does not keep its owners alive,
+        # see detached_rows
+        self.detached = detached
+        self.position = np.zeros((capacity, 2))
+        self.previous_position = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.collision_size = np.zeros((capacity, 2))
+        self.alive = np.zeros(capacity, dtype=bool)
+        # Rows that are released when their center leaves the bounds given to cull()
+        self.cull_outside = np.zeros(capacity, dtype=bool)
+        # Tags are stored as small integers so a tag group can be selected with one comparison
+        self.tag = np.zeros(capacity, dtype=np.int16)
+        self.tag_codes = {}
+        self.owners = [None] * capacity
+        self.free = []
+        # Rows [0, count) have been used, later rows are untouched
+        self.count = 0
+
+    def tag_code(self, tag):
+        if tag not in self.tag_codes:
+            self.tag_codes[tag] = len(self.tag_codes) + 1
+        return self.tag_codes[tag]
+
+    def row_nbytes(self):
+        """Bytes of one row across all the arrays."""
+        return sum(getattr(self, name)[:1].nbytes for name in self.columns)
+
+    def allocate(self, owner):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow(self.capacity * 2)
+            slot = self.count
+            self.count += 1
+        if not self.detached:
+            self.owners[slot] = owner
+        self.alive[slot] = True
+        self.cull_outside[slot] = getattr(owner, "cull", False)
+        self.tag[slot] = self.tag_code(owner.tag)
+        return slot
+
+    def release(self, slot):
+        self.owners[slot] = None
+        self.alive[slot] = False
+        # Dead rows are integrated with everything else, a zero velocity keeps that harmless
+        self.velocity[slot] = 0
+        self.free.append(slot)
+
+    def grow(self, capacity):
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        self.owners.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def adopt(self, owner):
+        """Move owner's row from the store it is currently in to this one."""
+        old_store, old_slot = owner.store, owner.slot
+        slot = self.allocate(owner)
+        if old_store is not None:
+            for name in ("position", "previous_position", "velocity", "size", "collision_size"):
+                getattr(self, name)[slot] = getattr(old_store, name)[old_slot]
+            old_store.release(old_slot)
+        owner.store = self
+        owner.slot = slot
+
+    def remove(self, owner):
+        """Move owner's row back to detached_rows, so it stays usable after it left this one."""
+        if owner.store is self:
+            detached_rows.adopt(owner)
+
+    def integrate(self, dt):
+        n = self.count
+        self.previous_position[:n] = self.position[:n]
+        self.position[:n] += self.velocity[:n] * dt
+
+    def mask(self, tag):
+        """Boolean mask of the live rows with tag."""
+        n = self.count
+        return self.alive[:n] & (self.tag[:n] == self.tag_codes.get(tag, -1))
+
+    def cull(self, bounds):
+        """Owners of cullable rows whose center is outside the bounds rect."""
+        n = self.count
+        x = self.position[:n, 0]
+        y = self.position[:n, 1]
+        outside = (x < bounds.left) | (x > bounds.right) | (y < bounds.top) | (y > bounds.bottom)
+        outside &= self.alive[:n] & self.cull_outside[:n]
+        return [self.owners[slot] for slot in np.flatnonzero(outside)]
+
+
+# Rows of every sprite that is not in an App. Sprites start here and return here when they are removed, their
+# rows are reused instead of each sprite allocating arrays of its own. Sprite.__del__ frees the row of a sprite
+# dropped while detached.
+detached_rows = EntityStore(1024, detached=True)
@@ -0,0 +1,31 @@
+class EventBus:
+    # Delivers each event only to the callbacks subscribed to its type, instead of to every object
+    def __init__(self):
+        # Event type -> {callback: None}, a dict keeps subscription order and makes unsubscribing O(1)
+        self.subscribers = {}
+        # Events posted by the game itself, delivered by dispatch_queued()
+        self.queue = []
+
+    def subscribe(self, event_type, callback):
+        self.subscribers.setdefault(event_type, {})[callback] = None
+
+    def unsubscribe(self, event_type, callback):
+        callbacks = self.subscribers.get(event_type)
+        if callbacks:
+            callbacks.pop(callback, None)
+
+    def post(self, event):
+        self.queue.append(event)
+
+    def dispatch(self, event):
+        callbacks = self.subscribers.get(event.type)
+        if callbacks:
+            # Callbacks may subscribe or unsubscribe while the event is being delivered
+            for callback in tuple(callbacks):
+                callback(event)
+
+    def dispatch_queued(self):
+        queue = self.queue
+        self.queue = []
+        for event in queue:
+            self.dispatch(event)
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class Formation:
+    # Moves the invaders as one rigid block. The formation owns a single offset and velocity and every member's
+    # position is its base position plus the offset, so marching and turning around is one check per step.
+    # left and right are the x positions the outermost live columns turn around at, drop is how far the block
+    # steps down on every turn and speedup is how much faster it gets as members die (1.0 doubles the speed
+    # when the last one is left).
+    def __init__(self, velocity=(60, 0), left=20, right=620, drop=0, speedup=0.0):
+        self.offset = np.zeros(2)
+        self.velocity = np.array(velocity, dtype=float)
+        self.base_speed = abs(self.velocity[0])
+        self.left = left
+        self.right = right
+        self.drop = drop
+        self.speedup = speedup
+        # member -> column
+        self.members = {}
+        self.bases = {}
+        # Live members per column, and the x of each column without the offset
+        self.column_counts = {}
+        self.column_x = {}
+        self.min_column = None
+        self.max_column = None
+        self.added = 0
+        # Slots and base positions of the members as arrays, rebuilt when the membership changes
+        self.slots = None
+        self.base_positions = None
+
+    def add(self, member, column, base=None):
+        """Add member at its current position, or at base, its place in the formation as it was when it
+        started moving. Members can be added while the formation moves, given a base they line up with the
+        others."""
+        self.members[member] = column
+        if base is None:
+            self.bases[member] = np.array(member.get_pos(), dtype=float) - self.offset
+        else:
+            self.bases[member] = np.array(base, dtype=float)
+            member.set_pos(self.bases[member] + self.offset)
+        self.column_counts[column] = self.column_counts.get(column, 0) + 1
+        self.column_x[column] = self.bases[member][0]
+        if self.min_column is None or column < self.min_column:
+            self.min_column = column
+        if self.max_column is None or column > self.max_column:
+            self.max_column = column
+        self.added += 1
+        self.slots = None
+
+    def remove(self, member):
+        column = self.members.pop(member, None)
+        if column is None:
+            return
+        del self.bases[member]
+        self.column_counts[column] -= 1
+        self.slots = None
+        if not self.members:
+            self.min_column = self.max_column = None
+            return
+        # Every column is stepped over at most once, so keeping the bounding columns is amortised O(1)
+        while not self.column_counts.get(self.min_column):
+            self.min_column += 1
+        while not self.column_counts.get(self.max_column):
+            self.max_column -= 1
+        speed = self.base_speed * (1 + self.speedup * (1 - len(self.members) / self.added))
+        self.velocity[0] = np.copysign(speed, self.velocity[0])
+
+    def __len__(self):
+        return len(self.members)
+
+    def update(self, dt, store):
+        if not self.members:
+            return
+        self.offset += self.velocity * dt
+        if self.velocity[0] < 0 and self.column_x[self.min_column] + self.offset[0] < self.left:
+            self.velocity[0] = -self.velocity[0]
+            self.offset[1] += self.drop
+        elif self.velocity[0] > 0 and self.column_x[self.max_column] + self.offset[0] > self.right:
+            self.velocity[0] = -self.velocity[0]
+            self.offset[1] += self.drop
+        if self.slots is None:
+            self.slots = np.array([member.slot for member in self.members], dtype=int)
+            self.base_positions = np.array(list(self.bases.values()))
+        store.position[self.slots] = self.base_positions + self.offset
@@ -0,0 +1,108 @@
+import json
+
+# Parsed level files by path
+levels = {}
+
+# What a wave is when its level file leaves something out. Speeds are in pixels per second, speedup is how much
+# faster the formation gets as it is destroyed (see Formation), fire intervals and frame durations are seconds.
+WAVE_DEFAULTS = {"columns": 10, "x": 30, "spacing": [42, 30], "size": [32, 32], "speed": 60, "left": 20,
+                 "right": 620, "drop": 0, "speedup": 0.0, "fire_interval": 2.0, "fire_jitter": 1.0,
+                 "frame_duration": 0.3}
+
+
+def load_level(path):
+    """Read a level file, see levels/classic.json."""
+    level = levels.get(path)
+    if level is None:
+        with open(path) as file:
+            level = json.load(file)
+        if not level.get("waves"):
+            raise ValueError(f"{path} has no waves")
+        level["waves"] = [dict(WAVE_DEFAULTS, **wave) for wave in level["waves"]]
+        level.setdefault("spawn_per_tick", 64)
+        level.setdefault("build_per_tick", 64)
+        levels[path] = level
+    return level
+
+
+def enemy_specs(wave):
+    """Yield (column, base position, sprite sheet frames) for every enemy of wave, one row after the other.
+    A row with a repeat count stands for that many rows with the same frames."""
+    dx, dy = wave["spacing"]
+    for row in wave["rows"]:
+        for i in range(row.get("repeat", 1)):
+            y = row["y"] + i * dy
+            for column in range(wave["columns"]):
+                yield column, (wave["x"] + column * dx, y), row["frames"]
+
+
+class WaveSpawner:
+    # Streams the waves of a level into a game. Enemies are built and added at most a budget per step instead of
+    # all at once, and the next wave is built while the current one is played, so a wave starting only has to
+    # add its enemies. A wave starts once the previous one is fully spawned and destroyed.
+    # build(wave, column, base, frames) creates an enemy, start(wave) is called as each wave begins.
+    def __init__(self, level, build, start):
+        self.waves = level["waves"]
+        self.spawn_per_tick = level["spawn_per_tick"]
+        self.build_per_tick = level["build_per_tick"]
+        self.build = build
+        self.start = start
+        # Index of the wave being played, -1 until the first one starts
+        self.current = -1
+        # Enemies of the current wave waiting to be added, as (enemy, column, base), and the specs of the ones
+        # not built yet, None once they all are
+        self.spawning = []
+        self.spawn_specs = None
+        # Enemies of the next wave built ahead, and the specs of the ones still to build
+        self.built = []
+        self.specs = enemy_specs(self.waves[0])
+
+    def wave_spawned(self):
+        return not self.spawning and self.spawn_specs is None
+
+    def done(self, formation):
+        """True once the last wave has been spawned and destroyed."""
+        return self.current == len(self.waves) - 1 and self.wave_spawned() and not formation
+
+    def make(self, wave, spec):
+        column, base, frames = spec
+        return self.build(wave, column, base, frames), column, base
+
+    def update(self, game):
+        if self.current + 1 < len(self.waves) and self.wave_spawned() and not game.formation:
+            self.next_wave()
+        wave = self.waves[self.current]
+        budget = self.spawn_per_tick
+        while budget and self.spawning:
+            enemy, column, base = self.spawning.pop()
+            game.formation.add(enemy, column, base)
+            game.add(enemy)
+            budget -= 1
+        # The wave started before it was built ahead, the rest is built as it is added
+        while budget and self.spawn_specs is not None:
+            spec = next(self.spawn_specs, None)
+            if spec is None:
+                self.spawn_specs = None
+                break
+            enemy, column, base = self.make(wave, spec)
+            game.formation.add(enemy, column, base)
+            game.add(enemy)
+            budget -= 1
+        if self.specs is not None and self.wave_spawned():
+            next_wave = self.waves[self.current + 1]
+            for _ in range(self.build_per_tick):
+                spec = next(self.specs, None)
+                if spec is None:
+                    self.specs = None
+                    break
+                self.built.append(self.make(next_wave, spec))
+
+    def next_wave(self):
+        self.current += 1
+        # Popped from the end, so reversed to add them in the order they were built
+        self.built.reverse()
+        self.spawning = self.built
+        self.spawn_specs = self.specs
+        self.built = []
+        self.specs = enemy_specs(self.waves[self.current + 1]) if self.current + 1 < len(self.waves) else None
+        self.start(self.waves[self.current])
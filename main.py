@@ -1,202 +1,232 @@
+import time
+
+# As close to the start of the process as the game can tell, for the time to first frame
+STARTED = time.perf_counter()
+
+import argparse
+import os
 import random
-import sys, pygame
+import struct
+import sys, zlib, pygame
 from pygame.locals import *
 from spritesheet import SpriteSheet, Sprite, SpriteText
+from assets import assets
+from renderer import DirtyRectRenderer
+from background import BackgroundLayer
+from entities import EntityStore
+from collision import CollisionEngine, surface_mask, rect_mask, circle_mask
+from registry import ObjectRegistry, TagGroup
+from events import EventBus
+from formation import Formation
+from replay import ReplayWriter, ReplayReader
+from profiler import FrameProfiler, ProfilerOverlay
+from text import get_font
+from pool import Pool
+from animation import Animator, get_clip
+from timers import TimerWheel
+from bundle import build_bundle, load_bundle
+from level import WaveSpawner, load_level
+from spectator import SpectatorServer, SpectatorClient
 
 clock = pygame.time.Clock()
 
+# Game events, delivered through App.events to the objects subscribed to them
+STOP_PLAYER = pygame.USEREVENT + 3
+HIT_ENEMY = pygame.USEREVENT + 4
+GAME_OVER = pygame.USEREVENT + 5
 
-class Enemy(Sprite):
-    def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None, images=None):
-        super(Enemy, self).__init__(file=file, pos=pos, size=size, velocity=velocity, image=image, tag="Enemy",
-                                    images=images)
-        self.initial_position = pos
-        self.left = False
-        self.right = False
-        self.index = 0
+# Tags of the game objects, in the order of their codes in an EntityStore
+TAGS = ("Player", "Enemy", "Obstacle", "PlayerBullet", "EnemyBullet", "Destruction", "Text", "Score")
 
-    def turn_around(self):
-        Sprite.set_velocity(self, [-self.velocity[0], 0])
+# Handled by App.do as soon as they arrive instead of at the next simulation step
+WINDOW_EVENTS = (QUIT, VIDEORESIZE, VIDEOEXPOSE, WINDOWEXPOSED)
 
-    def set_left(self):
-        self.left = True
+# Shows or hides the frame profiler overlay
+PROFILER_KEY = K_F3
 
-    def set_right(self):
-        self.right = True
+# Speeds are in pixels per second
+PLAYER_SPEED = 180
+PLAYER_BULLET_SPEED = 360
+ENEMY_BULLET_SPEED = 180
 
-    def do(self, event):
-        if event.type == game.TURN_AROUND:
-            Sprite.set_velocity(self, [-self.velocity[0], 0])
 
-    def change_sprite(self):
-        self.index += 1
-        if self.index >= len(self.images):
-            self.index = 0
-        self.image = self.images[self.index]
+class Enemy(Sprite):
+    __slots__ = ()
+
+    def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None, images=None,
+                 frame_duration=0.3):
+        super(Enemy, self).__init__(file=file, pos=pos, size=size, velocity=velocity, image=image, tag="Enemy",
+                                    images=images)
+        if self.images:
+            self.clip = get_clip("Enemy", self.images, frame_duration)
 
     def take_damage(self):
         # Activate hit enemy event
-        pygame.event.post(pygame.event.Event(game.HIT_ENEMY, score=100))
+        self.parent.post(pygame.event.Event(HIT_ENEMY, score=100))
         # Add destruction animation
-        destruction = Destruction((self.get_pos()[0], self.get_pos()[1]))
-        game.add(destruction)
-        game.remove(self)
-
-    def update(self):
-        super(Enemy, self).update()
-        if self.images:
-            if pygame.time.get_ticks() - self.elapsed > 300:  # animate every 0.3 second
-                self.change_sprite()
-                self.elapsed = pygame.time.get_ticks()
+        self.parent.spawn(Destruction, (self.get_pos()[0], self.get_pos()[1]))
+        self.parent.remove(self)
 
     def fire_bullet(self):
-        bullet = EnemyBullet((self.get_pos()[0], self.get_pos()[1] + 10))
-        game.add(bullet)
+        self.parent.spawn(EnemyBullet, (self.get_pos()[0], self.get_pos()[1] + 10))
 
 
 class Obstacle(Sprite):
-    def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), images=None):
-        super(Obstacle, self).__init__(file=file, pos=pos, size=size, velocity=velocity, images=images,
+    # Every hit carves a crater out of the obstacle's image and out of the mask of its solid pixels, bullets only
+    # hit where there are pixels left. The obstacle is gone once no pixel is.
+    __slots__ = ("base_image", "mask", "craters")
+    # Radius in pixels of the crater a bullet leaves
+    crater_radius = 6
+
+    def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None):
+        super(Obstacle, self).__init__(file=file, pos=pos, size=size, velocity=velocity, image=image,
                                        tag="Obstacle")
-        self.stages = len(self.images)
-        self.current_stage = 0
+        # Image and mask are shared with the other obstacles until the first hit copies them
+        self.base_image = self.image
+        self.mask = surface_mask(self.image)
+        # Centers of the craters carved so far, relative to the image
+        self.craters = []
         # pygame.draw.rect(self.image, (255, 255, 0), [0, 0, 64, 64], 1)
 
     def do(self, event):
         pass
 
-    def take_damage(self):
-        self.current_stage += 1
-        # print(self.current_stage, self.stages)
-        if self.current_stage >= self.stages:
-            game.remove(self)
-            return
-        self.image = self.images[self.current_stage]
-
-    def update(self):
-        super(Obstacle, self).update()
+    def impact(self, rect):
+        """The obstacle's pixel that rect overlaps, relative to its image, or None if it overlaps none."""
+        left, top = self.rect.topleft
+        return self.mask.overlap(rect_mask(rect.size), (rect.x - left, rect.y - top))
+
+    def take_damage(self, point=None):
+        if point is None:
+            point = self.mask.get_bounding_rects()[0].center if self.mask.count() else (0, 0)
+        if not self.craters:
+            self.image = self.image.copy()
+            self.mask = self.mask.copy()
+        self.craters.append(tuple(point))
+        radius = self.crater_radius
+        pygame.draw.circle(self.image, self.image.get_colorkey() or (0, 0, 0, 0), point, radius)
+        self.mask.erase(circle_mask(radius), (point[0] - radius, point[1] - radius))
+        self.image_changed()
+        if not self.mask.count():
+            self.parent.remove(self)
+
+    def update(self, dt):
+        super(Obstacle, self).update(dt)
 
 
 class Player(Sprite):
+    __slots__ = ()
+    events = (pygame.KEYDOWN, pygame.KEYUP, STOP_PLAYER)
+
     def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None):
         super(Player, self).__init__(file=file, pos=pos, size=size, velocity=velocity, image=image, tag="Player")
-        self.initial_position = pos
 
     def do(self, event):
         super(Player, self).do(event)
-        if event.type == (pygame.USEREVENT + 3) or event.type == pygame.KEYUP and (
+        if event.type == STOP_PLAYER or event.type == pygame.KEYUP and (
                 event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT):
             self.velocity = [0, 0]
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_LEFT and self.get_pos()[0] > 0:
-                self.velocity = [-2, 0]
+                self.velocity = [-PLAYER_SPEED, 0]
             elif event.key == pygame.K_RIGHT and self.get_pos()[0] < 640:
-                self.velocity = [2, 0]
+                self.velocity = [PLAYER_SPEED, 0]
             elif event.key == pygame.K_SPACE:  # Instantiate Bullet
-                if len(game.objects_tag_dict["PlayerBullet"]) == 0:
-                    bullet = PlayerBullet((self.get_pos()[0], self.get_pos()[1] - 10))
-                    game.add(bullet)
+                if len(self.parent.objects_tag_dict["PlayerBullet"]) == 0:
+                    self.parent.spawn(PlayerBullet, (self.get_pos()[0], self.get_pos()[1] - 10))
 
-    def update(self):
-        super(Player, self).update()
+    def update(self, dt):
+        super(Player, self).update(dt)
         if self.get_pos()[0] < 0 or self.get_pos()[0] > 640:
             # print("Outside", self.get_pos()[0])
-            my_event = pygame.event.Event(pygame.USEREVENT + 3)
-            pygame.event.post(my_event)
+            my_event = pygame.event.Event(STOP_PLAYER)
+            self.parent.post(my_event)
 
 
 class PlayerBullet(Sprite):
+    __slots__ = ()
+    cull = True
+    events = (GAME_OVER,)
+
     def __init__(self, pos=(0, 0)):
         # Give collision box size to reduce the collision box thickness
-        super(PlayerBullet, self).__init__(file=None, pos=pos, size=(32, 32), velocity=(0, -2), image=sprite_images[2],
+        super(PlayerBullet, self).__init__(file=None, pos=pos, size=(32, 32), velocity=(0, -PLAYER_BULLET_SPEED),
+                                           image=get_sprite_images()[2],
                                            tag="PlayerBullet", collision_box_size=(4, 12))
-        self.initial_position = pos
         # pygame.draw.rect(self.image, (255, 0, 255), [0, 0, 32, 32], 1)
 
+    def reset(self, pos):
+        super(PlayerBullet, self).reset(pos)
+        self.velocity = (0, -PLAYER_BULLET_SPEED)
+
     def do(self, event):
         super(PlayerBullet, self).do(event)
-        if event.type == game.GAME_OVER:
-            game.remove(self)
-
-    def update(self):
-        super(PlayerBullet, self).update()
+        if event.type == GAME_OVER:
+            self.parent.remove(self)
 
-        if self.get_pos()[1] < 30:
-            game.remove(self)
+    def update(self, dt):
+        super(PlayerBullet, self).update(dt)
 
 
 class EnemyBullet(Sprite):
+    __slots__ = ()
+    cull = True
+    events = (GAME_OVER,)
+
     def __init__(self, pos=(0, 0)):
         # Give collision box size to reduce the collision box thickness
+        sprite_images = get_sprite_images()
         self.images = [sprite_images[9], sprite_images[12]]
-        super(EnemyBullet, self).__init__(file=None, pos=pos, size=(32, 32), velocity=(0, 2), images=self.images,
+        super(EnemyBullet, self).__init__(file=None, pos=pos, size=(32, 32), velocity=(0, ENEMY_BULLET_SPEED),
+                                          images=self.images,
                                           tag="EnemyBullet", collision_box_size=(4, 12))
-        self.index = 0
+        self.clip = get_clip("EnemyBullet", self.images, 0.1)
         # pygame.draw.rect(self.image, (255, 0, 255), [0, 0, 32, 32], 1)
 
+    def reset(self, pos):
+        super(EnemyBullet, self).reset(pos)
+        self.velocity = (0, ENEMY_BULLET_SPEED)
+
     def do(self, event):
         super(EnemyBullet, self).do(event)
-        if event.type == game.GAME_OVER:
-            game.remove(self)
-
-    def change_sprite(self):
-        self.index += 1
-        if self.index >= len(self.images):
-            self.index = 0
-        self.image = self.images[self.index]
-
-    def update(self):
-        super(EnemyBullet, self).update()
-
-        if self.images:
-            if pygame.time.get_ticks() - self.elapsed > 100:  # animate every 0.3 second
-                self.change_sprite()
-                self.elapsed = pygame.time.get_ticks()
-
-        if self.get_pos()[1] > 800:
-            game.remove(self)
+        if event.type == GAME_OVER:
+            self.parent.remove(self)
 
 
 class Destruction(Sprite):
+    __slots__ = ()
+    events = (GAME_OVER,)
+
     def __init__(self, pos=(0, 0)):
         # Give collision box size to reduce the collision box thickness
+        sprite_images = get_sprite_images()
         self.images = [sprite_images[16], sprite_images[23], sprite_images[30]]
-        self.current_stage = 0
-        self.stages = len(self.images)
         super(Destruction, self).__init__(file=None, pos=pos, size=(32, 32), velocity=(0, 0), images=self.images,
-                                          tag="EnemyBullet", collision_box_size=(4, 12))
-        self.index = 0
+                                          tag="Destruction", collision_box_size=(4, 12))
+        # Plays once, the explosion is removed when it is over
+        self.clip = get_clip("Destruction", self.images, 0.1, loop=False)
         # pygame.draw.rect(self.image, (255, 0, 255), [0, 0, 32, 32], 1)
 
     def do(self, event):
         super(Destruction, self).do(event)
-        if event.type == game.GAME_OVER:
-            game.remove(self)
-
-    def change_sprite(self):
-        self.current_stage += 1
-        if self.current_stage >= self.stages:
-            game.remove(self)
-            return
-        self.image = self.images[self.current_stage]
+        if event.type == GAME_OVER:
+            self.parent.remove(self)
 
-    def update(self):
-        super(Destruction, self).update()
-
-        if self.images:
-            if pygame.time.get_ticks() - self.elapsed > 100:  # animate every 0.3 second
-                self.change_sprite()
-                self.elapsed = pygame.time.get_ticks()
+    def on_clip_end(self):
+        self.parent.remove(self)
 
 
 class Score(SpriteText):
+    __slots__ = ("score",)
+    events = (HIT_ENEMY,)
+
     def __init__(self, pos=(0, 0), font=None):
         self.score = 0
         super(Score, self).__init__(text=str(self.score), pos=pos, font=font, tag="Score")
 
     def do(self, event):
         super(Score, self).do(event)
-        if event.type == game.HIT_ENEMY:
+        if event.type == HIT_ENEMY:
             self.score += event.score
             self.update_text(str(self.score))
 
@@ -205,237 +235,705 @@ class Score(SpriteText):
 
 
 class App:
-    def __init__(self, file=None, caption='Pygame', size=(640, 800)):
-        pygame.init()
-        pygame.display.set_caption(caption)
+    # headless runs the simulation without a window or rendering, it is advanced with step(). With offscreen a
+    # headless game still draws, into an offscreen surface instead of the display.
+    # seed seeds the game's own random generator, time_source returns the real time in seconds and is only used
+    # by run() to pace the simulation.
+    def __init__(self, file=None, caption='Pygame', size=(640, 800), fps=60, tick_rate=120, max_steps=5,
+                 dirty_rects=True, headless=False, offscreen=False, seed=None, time_source=time.perf_counter):
+        self.headless = headless
         self.flags = RESIZABLE
         self.size = size
-        self.screen = pygame.display.set_mode(self.size, self.flags)
+        if headless:
+            pygame.font.init()
+            self.screen = pygame.Surface(self.size) if offscreen else None
+        else:
+            pygame.init()
+            pygame.display.set_caption(caption)
+            self.screen = pygame.display.set_mode(self.size, self.flags)
+        self.font = get_font(None, 28)
+        self.large_font = get_font(None, 64)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.time_source = time_source
         self.running = True
         self.updating = True
         self.game_over = False
         self.final_score = 0
-        self.objects = []
-        self.TURN_AROUND = pygame.USEREVENT + 1
-        self.HIT_ENEMY = pygame.USEREVENT + 4
-        self.GAME_OVER = pygame.USEREVENT + 5
+        self.objects = ObjectRegistry()
+        # uid given to the next object added
+        self.next_uid = 1
+        # Objects removed during a step are only taken out of the registry after it, see flush_removals()
+        self.pending_removals = {}
+        # Positions and velocities of all objects, integrated in batch every step.
+        # Known tags are registered first so their codes in the store are the same in every game.
+        self.store = EntityStore()
+        for tag in TAGS:
+            self.store.tag_code(tag)
+        # Bullets are removed once their center leaves these bounds
+        self.bounds = Rect(0, 30, self.size[0], self.size[1] - 30)
+        # Pairs of colliding tag groups are found over the store with a grid broadphase and vectorised tests
+        self.collision_engine = CollisionEngine(self.store)
+        self.HIT_ENEMY = HIT_ENEMY
+        self.GAME_OVER = GAME_OVER
+        # Objects subscribe to the event types listed in their events attribute when they are added
+        self.events = EventBus()
         self.player = None
+        # Moves the enemies, which are positioned by it instead of by their own velocity
+        self.formation = None
+        # Level file being played and the WaveSpawner adding its enemies, see generate_level()
+        self.level = None
+        self.waves = None
         # Maintain a tag dictionary for easy access of particular type
         # adding already know tags for easy access and no errors in loops
-        self.objects_tag_dict = {"PlayerBullet": [], "Enemy": [], "EnemyBullet": []}
+        self.objects_tag_dict = {"PlayerBullet": TagGroup(), "Enemy": TagGroup(), "EnemyBullet": TagGroup()}
         self.bg_color = 'black'
+        # Repaint only the changed parts of the screen instead of the whole window every frame
+        self.renderer = DirtyRectRenderer(self.screen) if dirty_rects and self.screen else None
+        # Static background tiles are baked into one surface instead of being added as objects
+        self.background = BackgroundLayer(self.size, self.bg_color)
+        self.rect = Rect((0, 0), self.size)
         if file:
             self.load_image(file)
-        else:
-            self.image = pygame.Surface(self.size)
-            self.image.fill(self.bg_color)
-            self.rect = self.image.get_rect()
         self.key_cmd = {}
-        self.time_elapsed = pygame.time.get_ticks()
+        # Rendering is capped at fps frames per second while the simulation always advances in fixed steps of
+        # dt seconds. At most max_steps are run per frame so a slow frame cannot snowball into a spiral of death.
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.dt = 1.0 / tick_rate
+        self.max_steps = max_steps
+        # Simulation steps taken, the simulated time is kept by the Animator and the TimerWheel
+        self.ticks = 0
+        # Input events waiting for the next simulation step
+        self.inputs = []
+        # ReplayWriter that every step's inputs and state hash are logged to
+        self.recorder = None
+        # SpectatorServer that every step's state is streamed to
+        self.spectators = None
+        # FrameProfiler timing every frame and the overlay showing it, both only exist once enabled
+        self.profiler = None
+        self.overlay = None
+        # Frames of the sprites that have a clip, from the simulated time
+        self.animations = Animator()
+        # Bullets and explosions are reused instead of created for every shot and kill, see spawn()
+        self.pools = {cls: Pool(cls, size) for cls, size in POOL_SIZES}
+        # Gameplay timers, advanced once per simulation step while the game is not paused
+        self.timers = TimerWheel(self.dt, rng=self.random)
+        # Seconds from STARTED until run() showed its first frame
+        self.first_frame = None
+        # A random enemy fires every 1 to 3 seconds, or as often as the current wave says
+        self.fire_timer = self.timers.every(2.0, self.fire_enemy_bullet, jitter=1.0)
 
     def load_image(self, file):
-        self.image = pygame.image.load(file).convert()
-        self.rect = self.image.get_rect()
+        image = pygame.image.load(file).convert()
+        self.rect = image.get_rect()
         self.screen = pygame.display.set_mode(self.rect.size, self.flags)
+        self.background.size = self.rect.size
+        self.background.add_tile(image, self.rect.center)
+        if self.renderer:
+            self.renderer.set_screen(self.screen)
 
     def run(self):
         print(self.objects_tag_dict.keys())
+        accumulator = 0.0
+        previous = self.time_source()
         while self.running:
+            # tick() sleeps to hold the frame rate
+            self.clock.tick(self.fps)
+            if self.profiler:
+                self.profiler.begin()
+            now = self.time_source()
+            accumulator += now - previous
+            previous = now
             for event in pygame.event.get():
-                self.do(event)
-            self.update()
-            self.draw()
+                if event.type in WINDOW_EVENTS or (event.type == KEYDOWN and event.key == PROFILER_KEY):
+                    self.do(event)
+                else:
+                    # Inputs are applied at the start of a simulation step, so a game only depends on its seed
+                    # and on the inputs of each step
+                    self.inputs.append(event)
+            if not self.running:
+                break
+            if self.profiler:
+                self.profiler.mark("events")
+            steps = 0
+            while accumulator >= self.dt and steps < self.max_steps:
+                inputs = self.inputs
+                self.inputs = []
+                self.step(inputs)
+                accumulator -= self.dt
+                steps += 1
+            if steps == self.max_steps:
+                # Drop the time we could not catch up on instead of carrying it to the next frame
+                accumulator = min(accumulator, self.dt)
+            # Nothing moves while paused, so there is nothing to interpolate
+            self.draw(accumulator / self.dt if self.updating else 1.0)
+            if self.first_frame is None:
+                self.first_frame = time.perf_counter() - STARTED
+                print(f"First frame after {self.first_frame * 1000:.0f} ms")
+            if self.profiler:
+                self.profiler.end(self.objects_tag_dict)
+        pygame.quit()
+
+    def step(self, inputs=()):
+        """Apply the input events and advance the simulation by one tick of dt seconds."""
+        for event in inputs:
+            self.do(event)
+        self.update(self.dt)
+        # Events the step posted, like HIT_ENEMY, are delivered before it returns so their effects belong to it
+        self.events.dispatch_queued()
+        if self.profiler:
+            self.profiler.mark("events")
+        self.ticks += 1
+        if self.recorder:
+            self.recorder.write(inputs, self.state_hash())
+        if self.spectators:
+            self.spectators.publish(self)
+        if self.profiler:
+            self.profiler.mark("stream")
+        return self.ticks
+
+    def get_score(self):
+        if self.game_over:
+            return self.final_score
+        if self.objects_tag_dict.get("Score"):
+            return self.objects_tag_dict["Score"][0].get_score()
+        return 0
+
+    def state_hash(self):
+        """Checksum of the simulation state, two games that stay in sync have the same hash after every step."""
+        n = self.store.count
+        state = zlib.crc32(self.store.position[:n].tobytes())
+        state = zlib.crc32(self.store.alive[:n].tobytes(), state)
+        return zlib.crc32(struct.pack("<qq", self.ticks, self.get_score()), state)
 
     def add_cmd(self, key, cmd):
         self.key_cmd[key] = cmd
         print(self.key_cmd)
 
+    def serve_spectators(self, address):
+        """Stream the game to viewers connecting to address, "HOST:PORT" or "unix:PATH"."""
+        self.spectators = SpectatorServer(address, fonts=(self.font, self.large_font))
+        return self.spectators
+
+    def enable_profiler(self, capacity=600):
+        if self.profiler is None:
+            self.profiler = FrameProfiler(TAGS, capacity)
+        return self.profiler
+
+    def toggle_overlay(self):
+        if self.overlay:
+            if self.renderer:
+                self.renderer.invalidate(self.overlay.rect)
+            self.overlay = None
+        elif self.screen is not None:
+            self.overlay = ProfilerOverlay(self.enable_profiler())
+
     def add(self, obj):
-        self.objects.append(obj)
+        # Adding an object again before its removal was applied cancels the removal
+        self.pending_removals.pop(obj, None)
+        if obj in self.objects:
+            return
+        self.objects.add(obj)
+        obj.uid = self.next_uid
+        self.next_uid += 1
         if obj.tag:
             if obj.tag not in self.objects_tag_dict:
-                self.objects_tag_dict[obj.tag] = []
+                self.objects_tag_dict[obj.tag] = TagGroup()
             self.objects_tag_dict[obj.tag].append(obj)
         obj.parent = self
+        self.store.adopt(obj)
+        for event_type in obj.events:
+            self.events.subscribe(event_type, obj.do)
+        if obj.clip:
+            self.animations.play(obj)
 
     def remove(self, obj):
-        # print(obj.tag)
+        # Queued, so objects can be removed while self.objects or a tag group is being iterated
         if obj in self.objects:
-            self.objects.remove(obj)
-        if obj.tag in self.objects_tag_dict and obj in self.objects_tag_dict[obj.tag]:
-            self.objects_tag_dict[obj.tag].remove(obj)
-        del obj
+            self.pending_removals[obj] = None
+
+    def flush_removals(self):
+        for obj in self.pending_removals:
+            self.objects.discard(obj)
+            if obj.tag in self.objects_tag_dict and obj in self.objects_tag_dict[obj.tag]:
+                self.objects_tag_dict[obj.tag].remove(obj)
+            self.store.remove(obj)
+            for event_type in obj.events:
+                self.events.unsubscribe(event_type, obj.do)
+            if self.formation:
+                self.formation.remove(obj)
+            self.animations.stop(obj)
+            obj.release()
+        self.pending_removals = {}
+
+    def spawn(self, cls, pos):
+        """Add a pooled sprite of class cls at pos."""
+        obj = self.pools[cls].acquire(pos)
+        self.add(obj)
+        return obj
+
+    def pool_stats(self):
+        return {cls.__name__: pool.stats() for cls, pool in self.pools.items()}
+
+    def memory_report(self):
+        """Bytes used per tag by the objects themselves, their rows in the store and the surfaces they show.
+        A surface shared by several objects is only counted for the first one."""
+        row_bytes = self.store.row_nbytes()
+        seen = set()
+        report = {}
+        for obj in self.objects:
+            entry = report.setdefault(obj.tag, {"count": 0, "object_bytes": 0, "store_bytes": 0, "surface_bytes": 0})
+            entry["count"] += 1
+            entry["object_bytes"] += sys.getsizeof(obj)
+            # Slotted objects have no __dict__
+            if hasattr(obj, "__dict__"):
+                entry["object_bytes"] += sys.getsizeof(obj.__dict__)
+            entry["store_bytes"] += row_bytes
+            for surface in obj.images or (obj.image,):
+                if id(surface) not in seen:
+                    seen.add(id(surface))
+                    entry["surface_bytes"] += surface.get_pitch() * surface.get_height()
+        total = {key: sum(entry[key] for entry in report.values())
+                 for key in ("count", "object_bytes", "store_bytes", "surface_bytes")}
+        # Rows allocated for objects that do not exist (yet)
+        total["store_unused_bytes"] = (self.store.capacity - total["count"]) * row_bytes
+        for entry in list(report.values()) + [total]:
+            entry["bytes_per_object"] = round(
+                (entry["object_bytes"] + entry["store_bytes"] + entry["surface_bytes"]) / max(entry["count"], 1))
+        report["total"] = total
+        return report
+
+    def post(self, event):
+        """Queue a game event, it is delivered at the start of the next simulation step."""
+        self.events.post(event)
 
     def do(self, event):
         if event.type == QUIT:
             self.running = False
-            pygame.quit()
+        elif event.type in (VIDEORESIZE, VIDEOEXPOSE, WINDOWEXPOSED):
+            if self.renderer:
+                self.renderer.set_screen(pygame.display.get_surface())
         elif event.type == KEYDOWN:
             if event.key == K_ESCAPE:
                 self.updating = not self.updating
+            if event.key == PROFILER_KEY:
+                self.toggle_overlay()
             if event.key in self.key_cmd:
                 cmd = self.key_cmd[event.key]
                 eval(cmd)
             if event.key == K_r and self.game_over:
                 self.clean_screen()
-                generate_level()
-
-        for obj in self.objects:
-            obj.do(event)
-
-    def update(self):
-        # Checking collision of enemies with playerbullet
-        if len(self.objects_tag_dict["PlayerBullet"]) > 0:
-            player_bullet = self.objects_tag_dict["PlayerBullet"][0]
-            for enemy in self.objects_tag_dict["Enemy"]:
-                if enemy.on_collision(player_bullet):
-                    # print("Collision with Enemy")
-                    self.remove(player_bullet)
-                    enemy.take_damage()
-            for obs in self.objects_tag_dict["Obstacle"]:
-                if obs.on_collision(player_bullet):
-                    # print("Damage Obstacle")
-                    self.remove(player_bullet)
-                    obs.take_damage()
-                    break
-        # Checking collision of Enemy Bullet with obstacle and player
-        for enemy_bullet in self.objects_tag_dict["EnemyBullet"]:
-            for obs in self.objects_tag_dict["Obstacle"]:
-                if obs.on_collision(enemy_bullet):
-                    # print("Damage Obstacle")
-                    self.remove(enemy_bullet)
-                    obs.take_damage()
-                    break
-            if self.player.on_collision(enemy_bullet):
+                generate_level(self)
+
+        self.events.dispatch(event)
+
+    def query_rect(self, rect, tag=None):
+        """Objects, optionally only those with tag, whose collision rect overlaps rect."""
+        return self.collision_engine.query_rect(rect, tag)
+
+    def check_collisions(self):
+        engine = self.collision_engine
+        # Every bullet damages at most one target, an enemy is killed at most once
+        hit = set()
+        # Player bullets hit enemies before obstacles
+        for player_bullet, enemy in engine.overlaps("PlayerBullet", "Enemy"):
+            if player_bullet not in hit and enemy not in hit:
+                hit.add(player_bullet)
+                hit.add(enemy)
+                self.remove(player_bullet)
+                enemy.take_damage()
+        # Obstacles are only tested pixel by pixel for the bullets whose rects overlap theirs
+        for bullet, obs in engine.overlaps("PlayerBullet", "Obstacle") + engine.overlaps("EnemyBullet", "Obstacle"):
+            if bullet not in hit:
+                point = obs.impact(bullet.collision_rect)
+                if point is not None:
+                    hit.add(bullet)
+                    self.remove(bullet)
+                    obs.take_damage(point)
+        for enemy_bullet, player in engine.overlaps("EnemyBullet", "Player"):
+            if enemy_bullet not in hit:
                 self.game_over = True
+                # Kills earlier in this step count towards the final score
+                self.events.dispatch_queued()
                 self.final_score = self.objects_tag_dict["Score"][0].get_score()
                 self.clean_screen()
                 self.show_game_over_screen()
+                break
 
-        # Generating Random Bullets by Enemy
-        if self.updating and pygame.time.get_ticks() - self.time_elapsed > random.randint(1000,
-                                                                                          3000):  # animate every 0.1 to 0.3 second
-            if len(self.objects_tag_dict["Enemy"]) > 0:
-                random.choice(self.objects_tag_dict["Enemy"]).fire_bullet()
-            self.time_elapsed = pygame.time.get_ticks()
+    def update(self, dt):
+        profiler = self.profiler
+        self.events.dispatch_queued()
+        if profiler:
+            profiler.mark("events")
+        self.check_collisions()
+        self.flush_removals()
+        if profiler:
+            profiler.mark("collisions")
+
+        if self.updating:
+            self.timers.advance()
+        if profiler:
+            profiler.mark("fire")
 
         # Update All Objects
         if self.updating:
+            if self.waves and not self.game_over:
+                self.waves.update(self)
+            self.store.integrate(dt)
+            if self.formation:
+                self.formation.update(dt, self.store)
+            self.animations.update(dt)
             for obj in self.objects:
-                obj.update()
-
-        # Check turning point of enemies Should be after updating of all objects
-        for enemy in self.objects_tag_dict["Enemy"]:
-            if 20 > enemy.get_pos()[0] or enemy.get_pos()[0] > 620:
-                pygame.event.post(pygame.event.Event(self.TURN_AROUND))
-                break
-
-    def draw(self):
-        self.screen.blit(self.image, self.rect)
-        for obj in self.objects:
-            obj.draw(self.screen)
-        pygame.display.update()
+                if obj not in self.pending_removals:
+                    obj.update(dt)
+            for obj in self.store.cull(self.bounds):
+                self.remove(obj)
+        self.flush_removals()
+        if profiler:
+            profiler.mark("update")
+
+    def set_fire_rate(self, interval, jitter=0.0):
+        self.fire_timer.cancel()
+        self.fire_timer = self.timers.every(interval, self.fire_enemy_bullet, jitter)
+
+    def level_cleared(self):
+        """True once every wave of the level has been spawned and destroyed."""
+        if self.waves is None:
+            return not len(self.objects_tag_dict["Enemy"])
+        return self.waves.done(self.formation)
+
+    def fire_enemy_bullet(self):
+        if len(self.objects_tag_dict["Enemy"]) > 0:
+            self.random.choice(self.objects_tag_dict["Enemy"]).fire_bullet()
+
+    def draw(self, alpha=1.0):
+        # alpha interpolates sprite positions between the last two simulation steps
+        if self.screen is None:
+            return
+        rebaked = self.background.bake()
+        if self.renderer:
+            for rect in rebaked:
+                self.renderer.invalidate(rect)
+            if self.overlay:
+                # The overlay is translucent, what is under it is repainted before it is drawn again
+                self.renderer.invalidate(self.overlay.rect)
+            rects = self.renderer.draw(self.background.surface, self.objects, alpha)
+        else:
+            self.background.draw(self.screen)
+            for obj in self.objects:
+                obj.draw(self.screen, alpha)
+            rects = None
+        if self.overlay:
+            rect = self.overlay.draw(self.screen)
+            if rects is not None:
+                rects.append(rect)
+        if self.profiler:
+            self.profiler.mark("draw")
+        self.present(rects)
+        if self.profiler:
+            self.profiler.mark("display")
+
+    def present(self, rects):
+        # rects is None when the whole screen has to be pushed to the display
+        if self.headless:
+            return
+        if rects is None:
+            pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
 
     def show_game_over_screen(self):
-        game_over_label = SpriteText(text="Game Over", pos=(200, 50), font=large_font)
-        game_over_score = SpriteText(text=f"Score :  {self.final_score}", pos=(200, 150), font=large_font)
-        game_over_restart = SpriteText(text="Press \"R\" to restart", pos=(150, 250), font=large_font)
+        game_over_label = SpriteText(text="Game Over", pos=(200, 50), font=self.large_font)
+        game_over_score = SpriteText(text=f"Score :  {self.final_score}", pos=(200, 150), font=self.large_font)
+        game_over_restart = SpriteText(text="Press \"R\" to restart", pos=(150, 250), font=self.large_font)
         self.add(game_over_label)
         self.add(game_over_score)
         self.add(game_over_restart)
 
     def clean_screen(self):
-        objects_list = self.objects.copy()
-
-        for obj in objects_list:
-            # if obj.tag != "Background":
+        for obj in self.objects:
             self.remove(obj)
-
-
-def generate_level():
-    enemies_sprites = []
-    left_obstacle_images = []
-    right_obstacle_images = []
-    left_obstacle_sprites = []
-    right_obstacle_sprites = []
+        self.flush_removals()
+
+
+# Sprites App.spawn() takes from a pool, and how many of each are created up front
+POOL_SIZES = ((PlayerBullet, 1), (EnemyBullet, 8), (Destruction, 8))
+
+
+def generate_background(game, level):
+    # Background Tiles, each layer covers a range of tile rows
+    background = level["background"]
+    tile_size = background["tile_size"]
+    game.background.clear()
+    for layer in background["layers"]:
+        tile = assets.load(layer["image"], (tile_size, tile_size))
+        first, last = layer["rows"]
+        for x in range(background["columns"]):
+            for y in range(first, last + 1):
+                # Half a tile is added so that position marks center of the rectangle
+                game.background.add_tile(tile, (tile_size * x + tile_size // 2, tile_size * y + tile_size // 2))
+    print(f"Adding {len(game.background.tiles)} Backgounds")
+
+
+def get_sprite_images():
+    # The sheet is sliced on first use and shared by every App in the process
+    global sprite_images
+    if sprite_images is None:
+        sprite_images = SpriteSheet(sprite_sheet_img).load_grid_images(5, 7)
+    return sprite_images
+
+
+def generate_level(game, level=None):
+    """Set up the level file at level, by default the one the game played last. Enemies are spawned by the
+    level's WaveSpawner as the game runs."""
+    game.level = level or game.level or default_level
+    level = load_level(game.level)
+    # A new round, waves only stream while the game is not over
+    game.game_over = False
+    game.final_score = 0
+    sprite_images = get_sprite_images()
     texts = []
-    for x in range(4):
-        left_obstacle_images.append(sprite_images[10 + x * 7])
-        right_obstacle_images.append(sprite_images[11 + x * 7])
-    posx = 77
-    for x in range(4):
-        obstacle = Obstacle(images=left_obstacle_images, pos=(posx, 500), size=(64, 64))
-        left_obstacle_sprites.append(obstacle)
-        posx += 64
-        obstacle = Obstacle(images=right_obstacle_images, pos=(posx, 500), size=(64, 64))
-        right_obstacle_sprites.append(obstacle)
-        posx += 75
-    score_label = SpriteText(text="Score : ", pos=(400, 50), font=font)
+    obstacle_sprites = []
+    for obstacle in level["obstacles"]:
+        obstacle_sprites.append(Obstacle(image=sprite_images[obstacle["frame"]], pos=obstacle["pos"],
+                                         size=level["obstacle_size"]))
+    score_label = SpriteText(text="Score : ", pos=(400, 50), font=game.font)
     texts.append(score_label)
-    score = Score(font=font, pos=(470, 50))
+    score = Score(font=game.font, pos=(470, 50))
     texts.append(score)
 
-
-    player = Player(image=sprite_images[4], pos=(320, 700), size=(32, 32))
+    player = Player(image=sprite_images[level["player"]["frame"]], pos=level["player"]["pos"],
+                    size=level["player"]["size"])
     game.player = player
 
-    # Background Sprites
-    bg_sprites = []
-    for x in range(5):
-        for y in range(7):
-            pos = (128 * x + 64, 128 * y + 64)  # 64 is added so that position marks center of the rectangle
-            if y <= 3:
-                bg_sprites.append(Sprite(file=bg_img, pos=pos, size=(128, 128), tag="Background"))
-            if y > 3:
-                bg_sprites.append(Sprite(file=bg_floor_img, pos=pos, size=(128, 128), tag="Background"))
-            elif y == 3:
-                bg_sprites.append(Sprite(file=bg_buildings_img, pos=pos, size=(128, 128), tag="Background"))
-    print(f"Adding {len(bg_sprites)} Backgounds")
-    for bg_sprite in bg_sprites:
-        game.add(bg_sprite)
-
-    # Line Enemies Sprite
-    for x in range(10):
-        for y in range(5):
-            enemy = Enemy(image=sprite_images[y * 7], pos=(42 * x + 30, 150 + 30 * y), size=(32, 32),
-                          velocity=[1, 0],
-                          images=[sprite_images[y * 7], sprite_images[y * 7 + 1]])
-            if x == 0:
-                enemy.set_left()
-            elif x == 9:
-                enemy.set_right()
-            enemies_sprites.append(enemy)
-    print(f"Adding {len(enemies_sprites)} Enemies")
-    for enemy_sprite in enemies_sprites:
-        game.add(enemy_sprite)
-
-    for obstacle_sprite in left_obstacle_sprites:
-        game.add(obstacle_sprite)
-    for obstacle_sprite in right_obstacle_sprites:
-        game.add(obstacle_sprite)
+    generate_background(game, level)
 
-    for text in texts:
-        game.add(text)
-    game.add(player)
-    print("Loaded")
+    def build_enemy(wave, column, base, frames):
+        images = [sprite_images[i] for i in frames]
+        return Enemy(image=images[0], pos=base, size=wave["size"], images=images,
+                     frame_duration=wave["frame_duration"])
 
+    def start_wave(wave):
+        game.formation = Formation(velocity=(wave["speed"], 0), left=wave["left"], right=wave["right"],
+                                   drop=wave["drop"], speedup=wave["speedup"])
+        game.set_fire_rate(wave["fire_interval"], wave["fire_jitter"])
 
-# sprite_images = SpriteSheet('Assets/SpaceInvaders.png').load_grid_images(5, 7)
-# bgrect = background.get_rect()
+    game.formation = None
+    game.waves = WaveSpawner(level, build_enemy, start_wave)
+    print(f"Level {level['name']}: {len(level['waves'])} waves")
 
-game = App(caption="Space Invaders by Ajay")
-# background = Sprite(file="Assets/SpaceInvaders_Background.png")
-bg_img="Assets/SpaceInvaders_Background.png"
-bg_floor_img="Assets/SpaceInvaders_BackgroundFloor.png"
-bg_buildings_img="Assets/SpaceInvaders_BackgroundBuildings.png"
-sprite_images = SpriteSheet('Assets/SpaceInvaders.png').load_grid_images(5, 7)
-font = pygame.font.Font(None, 28)
-large_font = pygame.font.Font(None, 64)
-generate_level()
-
-# fonts = pygame.font.get_fonts()
-# print(len(fonts))
-# for f in fonts:
-#     print(f)
+    for obstacle_sprite in obstacle_sprites:
+        game.add(obstacle_sprite)
 
-game.run()
+    for text in texts:
+        game.add(text)
+    game.add(player)
+    print("Loaded", assets)
+
+
+sprite_sheet_img = "Assets/SpaceInvaders.png"
+default_level = "levels/classic.json"
+# Sliced and scaled frames of the images above, written by --build-bundle and used instead of them if present
+bundle_path = "Assets/frames.npz"
+sprite_images = None
+
+
+def run_headless(ticks, seed=None, profile=False, level=None, serve=None):
+    """Play ticks simulation steps without a window or input and return the game. With profile every step is
+    timed as one frame of game.profiler. With serve every step is streamed to the spectators at that address."""
+    game = App(headless=True, seed=seed)
+    if serve:
+        game.serve_spectators(serve)
+    generate_level(game, level)
+    profiler = game.enable_profiler() if profile else None
+    for _ in range(ticks):
+        if profiler:
+            profiler.begin()
+        game.step()
+        if profiler:
+            profiler.end(game.objects_tag_dict)
+        if game.game_over:
+            break
+    return game
+
+
+def run_replay(path, render=False):
+    """Play a recorded game back as fast as possible and check it stays in sync with the recording.
+    Returns (ticks, seconds, first desynced tick or None)."""
+    reader = ReplayReader(path)
+    game = App(caption="Space Invaders replay", headless=not render, seed=reader.seed,
+               tick_rate=reader.tick_rate)
+    generate_level(game, reader.level or None)
+    desync = None
+    start = time.perf_counter()
+    try:
+        for inputs, state_hash in reader:
+            game.step(inputs)
+            if desync is None and game.state_hash() != state_hash:
+                desync = game.ticks
+            if render:
+                # The whole queue is drained, events left in it would pile up until SDL drops new ones, QUIT too
+                if any(event.type == QUIT for event in pygame.event.get()):
+                    break
+                game.draw()
+    finally:
+        reader.close()
+    return game.ticks, time.perf_counter() - start, desync
+
+
+def apply_snapshot(game, message, replicas, surfaces):
+    """Make the objects of a spectating game match a message of a SpectatorServer. replicas maps the uids of the
+    server's objects to the objects standing in for them, surfaces the server's surface ids to surfaces."""
+    if message.keyframe:
+        game.clean_screen()
+        replicas.clear()
+        if message.level and message.level != game.level:
+            game.level = message.level
+            generate_background(game, load_level(message.level))
+    for uid in message.removed.tolist():
+        obj = replicas.pop(uid, None)
+        if obj is not None:
+            game.remove(obj)
+    game.flush_removals()
+    texts = {uid: (font, text) for uid, font, text in message.texts}
+    tags = {code: tag for tag, code in game.store.tag_codes.items()}
+    fonts = (game.font, game.large_font)
+    for uid, code, x, y, frame in message.entities.tolist():
+        obj = replicas.get(uid)
+        image = surfaces.get(frame)
+        if obj is None:
+            tag = tags.get(code, "Sprite")
+            if uid in texts:
+                font, text = texts.pop(uid)
+                obj = SpriteText(text=text, pos=(x, y), tag=tag, font=fonts[font])
+            elif tag == "Obstacle":
+                obj = Obstacle(image=image, pos=(x, y), size=image.get_size())
+            else:
+                obj = Sprite(image=image, pos=(x, y), size=image.get_size() if image else None, tag=tag)
+            replicas[uid] = obj
+            game.add(obj)
+            continue
+        obj.set_pos((x, y))
+        if image is not None and obj.tag != "Obstacle" and obj.image is not image:
+            obj.image = image
+            obj.set_size(image.get_size())
+    for uid, (font, text) in texts.items():
+        obj = replicas.get(uid)
+        if obj is not None:
+            obj.update_text(text)
+    for uid, x, y in message.craters.tolist():
+        obj = replicas.get(uid)
+        if obj is not None:
+            obj.take_damage((x, y))
+    game.flush_removals()
+
+
+def run_spectator(address):
+    """Show the game streamed by the SpectatorServer at address until the window is closed."""
+    # The game is never stepped, its objects only move when the server says so
+    game = App(caption="Space Invaders spectator")
+    client = SpectatorClient(address)
+    replicas = {}
+    while game.running:
+        game.clock.tick(game.fps)
+        # Input is ignored but still taken off the queue, so it cannot fill up and drop QUIT
+        for event in pygame.event.get():
+            if event.type in WINDOW_EVENTS:
+                game.do(event)
+        for message in client.receive():
+            apply_snapshot(game, message, replicas, client.surfaces)
+        if client.closed:
+            print("The game ended")
+            game.running = False
+        game.draw()
+    print(f"Received {client.bytes_received} bytes")
+    client.close()
+    pygame.quit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Space Invaders")
+    parser.add_argument("--headless", action="store_true", help="simulate without a window and print the result")
+    parser.add_argument("--ticks", type=int, default=10000, help="simulation steps to run with --headless")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--level", metavar="PATH", default=default_level, help="level file to play")
+    parser.add_argument("--record", metavar="PATH", help="log the seed and every tick's inputs to PATH")
+    parser.add_argument("--replay", metavar="PATH", help="play a recorded game back at full speed and check it")
+    parser.add_argument("--render", action="store_true", help="draw the game while replaying")
+    parser.add_argument("--bundle", metavar="PATH", default=bundle_path,
+                        help="take the game's images from this bundle when it exists")
+    parser.add_argument("--build-bundle", action="store_true",
+                        help="decode, slice and scale every image the game uses and write them to the bundle")
+    parser.add_argument("--memory", action="store_true", help="print memory_report() after a --headless run")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="stream the game to spectators connecting to HOST:PORT or unix:PATH")
+    parser.add_argument("--watch", metavar="ADDRESS", help="spectate the game streamed at ADDRESS")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="time every frame and write the statistics to PATH on exit, as JSON if it ends in "
+                             ".json and as one CSV row per frame otherwise")
+    args = parser.parse_args(argv)
+
+    if args.build_bundle:
+        generate_level(App(headless=True))
+        print(f"Wrote {build_bundle(args.bundle)} images to {args.bundle}")
+        return
+    if os.path.exists(args.bundle):
+        load_bundle(args.bundle)
+
+    if args.watch:
+        run_spectator(args.watch)
+        return
+
+    if args.replay:
+        ticks, elapsed, desync = run_replay(args.replay, args.render)
+        print(f"Replayed {ticks} ticks in {elapsed:.2f}s ({elapsed * 1000 / max(ticks, 1):.3f} ms/tick)")
+        if desync is not None:
+            print(f"Desync at tick {desync}")
+            sys.exit(1)
+        return
+
+    if args.headless:
+        start = time.perf_counter()
+        game = run_headless(args.ticks, args.seed, profile=bool(args.profile), level=args.level, serve=args.serve)
+        elapsed = time.perf_counter() - start
+        print(f"{game.ticks} ticks in {elapsed:.2f}s ({game.ticks / elapsed:.0f} ticks/s), "
+              f"game over {game.game_over}")
+        print("Pools", game.pool_stats())
+        if game.spectators:
+            print("Spectators", game.spectators.stats(1 / game.dt))
+            game.spectators.close()
+        if args.memory:
+            for tag, entry in game.memory_report().items():
+                print(f"{tag:<12} {entry}")
+        if args.profile:
+            game.profiler.export(args.profile)
+        return
+
+    seed = args.seed
+    if args.record and seed is None:
+        # A replay needs to know the seed
+        seed = random.randrange(2 ** 63)
+    game = App(caption="Space Invaders by Ajay", seed=seed)
+    if args.record:
+        game.recorder = ReplayWriter(args.record, seed, 1 / game.dt, args.level)
+    if args.profile:
+        game.enable_profiler()
+    if args.serve:
+        game.serve_spectators(args.serve)
+    generate_level(game, args.level)
+    try:
+        game.run()
+    finally:
+        if game.recorder:
+            game.recorder.close()
+        if game.profiler and args.profile:
+            game.profiler.export(args.profile)
+        if game.spectators:
+            print("Spectators", game.spectators.stats(1 / game.dt))
+            game.spectators.close()
+        print("Pools", game.pool_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+class Pool:
+    # Keeps sprites of one class that are done with, so new ones are reset instead of built from scratch.
+    # Pooled sprites are handed out by acquire(pos) and go back with their release() once their App removed them.
+    def __init__(self, cls, size=0):
+        self.cls = cls
+        self.free = []
+        self.created = 0
+        self.in_use = 0
+        # Most sprites in use at the same time
+        self.high_water = 0
+        for _ in range(size):
+            self.free.append(self.create())
+
+    def create(self):
+        obj = self.cls()
+        obj.pool = self
+        self.created += 1
+        return obj
+
+    def acquire(self, pos):
+        obj = self.free.pop() if self.free else self.create()
+        obj.reset(pos)
+        self.in_use += 1
+        if self.in_use > self.high_water:
+            self.high_water = self.in_use
+        return obj
+
+    def release(self, obj):
+        self.free.append(obj)
+        self.in_use -= 1
+
+    def stats(self):
+        return {"size": self.created, "free": len(self.free), "in_use": self.in_use, "high_water": self.high_water}
+
+    def __repr__(self):
+        return f"Pool({self.cls.__name__}, {self.in_use} in use, {len(self.free)} free, high water {self.high_water})"
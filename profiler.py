@@ -0,0 +1,127 @@
+import csv
+import json
+import time
+
+import numpy as np
+import pygame
+
+from text import get_atlas, get_font
+
+# Phases of a frame in the order they run, each timed from the end of the previous one. stream is the replay
+# recording and spectator streaming done at the end of every step.
+PHASES = ("events", "collisions", "fire", "update", "stream", "draw", "display")
+
+
+class FrameProfiler:
+    # Times the phases of the last capacity frames in a ring buffer, along with the number of objects of each
+    # tag at the end of every frame. The game only calls it when it has one, so it costs nothing when disabled.
+    def __init__(self, tags, capacity=600):
+        self.tags = tuple(tags)
+        self.capacity = capacity
+        self.phase_index = {phase: i for i, phase in enumerate(PHASES)}
+        # Seconds spent in each phase and object counts per frame, frames are written at index % capacity
+        self.times = np.zeros((capacity, len(PHASES)))
+        self.counts = np.zeros((capacity, len(self.tags)), dtype=np.int32)
+        self.frames = 0
+        self.row = self.times[0]
+        self.last = time.perf_counter()
+
+    def begin(self):
+        """Start timing a frame."""
+        self.row = self.times[self.frames % self.capacity]
+        self.row[:] = 0
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Add the time since the previous mark to phase. A phase can be marked several times in a frame, for
+        instance once per simulation step."""
+        now = time.perf_counter()
+        self.row[self.phase_index[phase]] += now - self.last
+        self.last = now
+
+    def end(self, groups):
+        """Finish the frame and record the size of the tag groups in groups."""
+        counts = self.counts[self.frames % self.capacity]
+        for i, tag in enumerate(self.tags):
+            counts[i] = len(groups.get(tag, ()))
+        self.frames += 1
+
+    def recorded(self):
+        """Times and counts of the frames in the buffer, oldest first."""
+        n = min(self.frames, self.capacity)
+        start = self.frames % self.capacity if self.frames > self.capacity else 0
+        order = (np.arange(n) + start) % self.capacity
+        return self.times[order], self.counts[order]
+
+    def summary(self):
+        times, counts = self.recorded()
+        summary = {"frames": self.frames, "window": len(times), "phases_ms": {}, "objects": {}}
+        if not len(times):
+            return summary
+        ms = np.column_stack((times, times.sum(axis=1))) * 1000
+        p50, p95, p99 = np.percentile(ms, (50, 95, 99), axis=0)
+        for i, phase in enumerate(PHASES + ("total",)):
+            summary["phases_ms"][phase] = {"mean": round(float(ms[:, i].mean()), 4), "p50": round(float(p50[i]), 4),
+                                           "p95": round(float(p95[i]), 4), "p99": round(float(p99[i]), 4),
+                                           "max": round(float(ms[:, i].max()), 4)}
+        for i, tag in enumerate(self.tags):
+            summary["objects"][tag] = {"last": int(counts[-1, i]), "max": int(counts[:, i].max())}
+        return summary
+
+    def lines(self):
+        """Text of the overlay."""
+        summary = self.summary()
+        lines = [f"{'ms':<10} {'p50':>6} {'p95':>6} {'p99':>6}"]
+        for phase, stats in summary["phases_ms"].items():
+            lines.append(f"{phase:<10} {stats['p50']:6.2f} {stats['p95']:6.2f} {stats['p99']:6.2f}")
+        lines.append(" ".join(f"{tag}:{stats['last']}" for tag, stats in summary["objects"].items() if stats["max"]))
+        return lines
+
+    def export(self, path):
+        """Write the summary to path if it ends in .json, otherwise every frame in the buffer as CSV."""
+        if path.endswith(".json"):
+            with open(path, "w") as file:
+                json.dump(self.summary(), file, indent=2)
+            return
+        times, counts = self.recorded()
+        first = self.frames - len(times)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("frame",) + tuple(f"{phase}_ms" for phase in PHASES) + self.tags)
+            for i in range(len(times)):
+                writer.writerow([first + i] + [round(t * 1000, 4) for t in times[i]] + counts[i].tolist())
+
+
+class ProfilerOverlay:
+    # Draws the profiler's statistics in a corner of the screen. The text is only re-rendered every interval
+    # seconds, so the overlay itself barely shows up in the numbers.
+    def __init__(self, profiler, pos=(4, 4), interval=0.25):
+        self.profiler = profiler
+        self.pos = pos
+        self.interval = interval
+        self.atlas = get_atlas(get_font(None, 20), (255, 255, 0), antialias=True)
+        self.image = None
+        self.rendered_at = 0.0
+
+    @property
+    def rect(self):
+        return self.image.get_rect(topleft=self.pos) if self.image else pygame.Rect(self.pos, (0, 0))
+
+    def render(self):
+        lines = [self.atlas.render(line) for line in self.profiler.lines()]
+        width = max(line.get_width() for line in lines) + 8
+        height = sum(line.get_height() for line in lines) + 8
+        self.image = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.image.fill((0, 0, 0, 170))
+        y = 4
+        for line in lines:
+            self.image.blit(line, (4, y))
+            y += line.get_height()
+
+    def draw(self, surf):
+        now = time.perf_counter()
+        if self.image is None or now - self.rendered_at > self.interval:
+            self.render()
+            self.rendered_at = now
+        surf.blit(self.image, self.pos)
+        return self.rect
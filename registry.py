@@ -0,0 +1,65 @@
+class TagGroup:
+    # List of the objects with one tag. Removal swaps the last item into the hole, so it is O(1) but does not keep
+    # the order. Supports len(), indexing and random.choice like a list.
+    def __init__(self):
+        self.items = []
+        self.index = {}
+
+    def append(self, obj):
+        if obj in self.index:
+            return
+        self.index[obj] = len(self.items)
+        self.items.append(obj)
+
+    def remove(self, obj):
+        i = self.index.pop(obj)
+        last = self.items.pop()
+        if last is not obj:
+            self.items[i] = last
+            self.index[last] = i
+
+    def __contains__(self, obj):
+        return obj in self.index
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"TagGroup({self.items})"
+
+
+class ObjectRegistry:
+    # Objects in the order they were added, which is the order they are drawn in, with O(1) add and remove.
+    # Iterating works on a snapshot, so objects can be added or removed while the registry is being iterated.
+    def __init__(self):
+        self.objects = {}
+        self.snapshot = None
+
+    def add(self, obj):
+        self.objects[obj] = None
+        self.snapshot = None
+
+    def discard(self, obj):
+        if obj in self.objects:
+            del self.objects[obj]
+            self.snapshot = None
+
+    def copy(self):
+        return list(self.objects)
+
+    def __contains__(self, obj):
+        return obj in self.objects
+
+    def __iter__(self):
+        if self.snapshot is None:
+            self.snapshot = tuple(self.objects)
+        return iter(self.snapshot)
+
+    def __len__(self):
+        return len(self.objects)
@@ -0,0 +1,93 @@
+import pygame
+
+
+class DirtyRectRenderer:
+    # Redraws only the parts of the screen where a sprite moved, changed image, appeared or disappeared.
+    # Falls back to a full redraw when more than full_redraw_ratio of the screen is dirty.
+    def __init__(self, screen, full_redraw_ratio=0.5):
+        self.screen = screen
+        self.full_redraw_ratio = full_redraw_ratio
+        # Sprite -> (rect, image) as drawn on the previous frame
+        self.last_drawn = {}
+        # Extra regions to repaint on the next frame
+        self.invalid_rects = []
+        self.full_redraw = True
+
+    def set_screen(self, screen):
+        self.screen = screen
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        """Repaint rect on the next frame, or the whole screen if no rect is given."""
+        if rect is None:
+            self.full_redraw = True
+        else:
+            self.invalid_rects.append(pygame.Rect(rect))
+
+    def redraw(self, obj):
+        """Repaint obj on the next frame, for when its image was drawn into instead of replaced."""
+        last = self.last_drawn.get(obj)
+        if last:
+            self.invalid_rects.append(last[0])
+
+    def draw(self, background, objects, alpha=1.0):
+        """Draw objects over background and return the list of rects to present, or None if the whole screen
+        was redrawn."""
+        drawn = {}
+        dirty = self.invalid_rects
+        self.invalid_rects = []
+        for obj in objects:
+            image = obj.image
+            # blit draws the whole image from the rect's top left, which can be larger than the rect itself
+            rect = image.get_rect(topleft=obj.interpolated_rect(alpha).topleft)
+            last = self.last_drawn.pop(obj, None)
+            if last is None:
+                dirty.append(rect)
+            elif last[1] is not image or last[0] != rect:
+                dirty.append(last[0])
+                dirty.append(rect)
+            drawn[obj] = (rect, image)
+        # Whatever is left was removed since the last frame
+        for rect, image in self.last_drawn.values():
+            dirty.append(rect)
+        self.last_drawn = drawn
+
+        screen_rect = self.screen.get_rect()
+        if not self.full_redraw:
+            dirty = self.merge(dirty, screen_rect)
+            dirty_area = sum(rect.w * rect.h for rect in dirty)
+            if dirty_area > self.full_redraw_ratio * screen_rect.w * screen_rect.h:
+                self.full_redraw = True
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.screen.blit(background, (0, 0))
+            for rect, image in drawn.values():
+                self.screen.blit(image, rect)
+            return None
+
+        items = list(drawn.values())
+        rects = [rect for rect, image in items]
+        for dirty_rect in dirty:
+            self.screen.set_clip(dirty_rect)
+            self.screen.blit(background, dirty_rect, dirty_rect)
+            # collidelistall keeps the list order, so sprites are still drawn back to front
+            for i in dirty_rect.collidelistall(rects):
+                self.screen.blit(items[i][1], rects[i])
+        self.screen.set_clip(None)
+        return dirty
+
+    @staticmethod
+    def merge(rects, bounds):
+        """Clip rects to bounds and union the overlapping ones so no pixel is repainted twice."""
+        merged = []
+        for rect in rects:
+            rect = rect.clip(bounds)
+            if not rect.w or not rect.h:
+                continue
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
@@ -0,0 +1,67 @@
+import struct
+
+import pygame
+
+# File layout: header, then one record per simulation tick.
+# Header: magic, format version, seed, tick rate, length of the level path, then the level path in UTF-8.
+# Tick record: state hash after the tick, number of input events, then (event type, key) per event.
+MAGIC = b"SIRP"
+VERSION = 2
+HEADER = struct.Struct("<4sHqdH")
+TICK = struct.Struct("<IH")
+EVENT = struct.Struct("<HI")
+
+# Only these events change the simulation, everything else is left out of the log
+RECORDED_EVENTS = (pygame.KEYDOWN, pygame.KEYUP)
+
+
+class ReplayWriter:
+    # Streams the seed, the level and every tick's inputs and state hash to a file as the game is played
+    def __init__(self, path, seed, tick_rate, level=""):
+        self.path = path
+        self.file = open(path, "wb")
+        level = level.encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, tick_rate, len(level)))
+        self.file.write(level)
+        self.ticks = 0
+
+    def write(self, inputs, state_hash):
+        events = [event for event in inputs if event.type in RECORDED_EVENTS]
+        self.file.write(TICK.pack(state_hash, len(events)))
+        for event in events:
+            self.file.write(EVENT.pack(event.type, event.key))
+        self.ticks += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayReader:
+    # Reads a log written by ReplayWriter one tick at a time, so whole sessions are never held in memory
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        header = self.file.read(HEADER.size)
+        magic, version = header[:4], header[4:6]
+        if len(header) < HEADER.size or magic != MAGIC or version != struct.pack("<H", VERSION):
+            self.file.close()
+            raise ValueError(f"{path} is not a version {VERSION} replay")
+        _, _, self.seed, self.tick_rate, level_length = HEADER.unpack(header)
+        self.level = self.file.read(level_length).decode()
+
+    def __iter__(self):
+        """Yield (inputs, state hash) for every recorded tick."""
+        read = self.file.read
+        while True:
+            record = read(TICK.size)
+            if len(record) < TICK.size:
+                return
+            state_hash, count = TICK.unpack(record)
+            inputs = []
+            for _ in range(count):
+                event_type, key = EVENT.unpack(read(EVENT.size))
+                inputs.append(pygame.event.Event(event_type, key=key))
+            yield inputs, state_hash
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,370 @@
+import collections
+import json
+import os
+import socket
+import stat
+import struct
+import time
+
+import numpy as np
+
+from assets import assets
+from bundle import as_key
+
+# Stream layout: a keyframe with the whole state when a viewer connects, then one delta per simulation tick with
+# only what changed since the tick before. Every message is:
+# header: length of the rest of the message, kind, tick, then the number of surfaces, entities, removed
+#   entities, texts and craters that follow
+# keyframes only: length of the level path, then the level path in UTF-8
+# surfaces: id and length, then the asset cache key of the surface as JSON, each id is only defined once
+# entities: one ENTITY record per new entity or entity whose tag, position or frame changed
+# removed: the uid of every entity removed
+# texts: uid, font and length, then the text in UTF-8, for texts that are new or changed
+# craters: one CRATER record per crater carved into an obstacle
+KEYFRAME = 1
+DELTA = 2
+HEADER = struct.Struct("<IBIHIIHI")
+LEVEL = struct.Struct("<H")
+SURFACE = struct.Struct("<HH")
+TEXT = struct.Struct("<IBH")
+# Positions are rounded to whole pixels, frame is the id of the surface shown or -1 for surfaces that are not
+# from the asset cache, like text
+ENTITY = np.dtype([("uid", "<u4"), ("tag", "u1"), ("x", "<i2"), ("y", "<i2"), ("frame", "<i2")])
+CRATER = np.dtype([("uid", "<u4"), ("x", "<i2"), ("y", "<i2")])
+UID = np.dtype("<u4")
+
+
+def parse_address(address):
+    """(family, address) of "unix:PATH" or "HOST:PORT"."""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class Viewer:
+    # A connected socket and the messages waiting to be sent to it, the first one possibly partly sent
+    def __init__(self, sock):
+        self.sock = sock
+        self.queue = collections.deque()
+        self.queued = 0
+        self.needs_keyframe = True
+
+    def push(self, message):
+        self.queue.append(memoryview(message))
+        self.queued += len(message)
+
+    def flush(self):
+        """Send as much as the socket takes without blocking, returns the number of bytes sent."""
+        sent = 0
+        while self.queue:
+            head = self.queue[0]
+            try:
+                n = self.sock.send(head)
+            except BlockingIOError:
+                break
+            sent += n
+            self.queued -= n
+            if n < len(head):
+                self.queue[0] = head[n:]
+                break
+            self.queue.popleft()
+        return sent
+
+    def drop_backlog(self):
+        # Only whole messages are dropped, the viewer gets a keyframe after the one being sent
+        while len(self.queue) > 1:
+            self.queued -= len(self.queue.pop())
+        self.needs_keyframe = True
+
+
+class SpectatorServer:
+    # Streams the state of an App to any number of viewers. The game calls publish() after every step, which
+    # accepts new viewers, encodes the step and sends it without ever blocking. Viewers that fall more than
+    # max_queued bytes behind lose their backlog and get a keyframe instead, so a slow viewer costs the game
+    # nothing but memory. fonts are the fonts texts can use, a text's font is sent as its index.
+    def __init__(self, address, fonts=(), max_queued=1 << 20, capacity=600):
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            # A socket left by an earlier server is replaced, anything else at the path is not ours to delete
+            if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+                raise ValueError(f"{self.address} exists and is not a socket")
+            os.unlink(self.address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.fonts = list(fonts)
+        self.max_queued = max_queued
+        self.viewers = []
+        # Entities sent last tick sorted by uid, texts and number of craters sent per uid
+        self.entities = np.zeros(0, ENTITY)
+        self.texts = {}
+        self.craters = {}
+        # Asset cache key -> surface id, and id of a cached surface -> its surface id
+        self.surface_ids = {}
+        self.frame_ids = {}
+        self.new_surfaces = []
+        # Seconds spent encoding and bytes of delta of the last capacity ticks, written at index % capacity
+        self.capacity = capacity
+        self.encode_times = np.zeros(capacity)
+        self.delta_bytes = np.zeros(capacity, dtype=np.int64)
+        self.ticks = 0
+        self.keyframes = 0
+        self.resyncs = 0
+        self.bytes_sent = 0
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except BlockingIOError:
+                return
+            sock.setblocking(False)
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.viewers.append(Viewer(sock))
+
+    def frame_id(self, obj):
+        # Obstacles draw their craters into a copy of the image they started with
+        image = getattr(obj, "base_image", None)
+        if image is None:
+            image = obj.image
+        frame = self.frame_ids.get(id(image))
+        if frame is not None:
+            return frame
+        key = assets.keys.get(id(image))
+        if key is None or not isinstance(key[0], (str, tuple)):
+            return -1
+        frame = self.surface_ids.get(key)
+        if frame is None:
+            frame = self.surface_ids[key] = len(self.surface_ids)
+            self.new_surfaces.append((frame, key))
+        # The cache keeps the surface alive, so its id is not reused
+        self.frame_ids[id(image)] = frame
+        return frame
+
+    def snapshot(self, game):
+        """ENTITY records of every object of game sorted by uid, and the objects in the same order."""
+        store = game.store
+        slots = np.flatnonzero(store.alive[:store.count])
+        objects = [store.owners[slot] for slot in slots]
+        entities = np.empty(len(objects), ENTITY)
+        entities["uid"] = [obj.uid for obj in objects]
+        entities["tag"] = store.tag[slots]
+        position = np.rint(store.position[slots])
+        entities["x"] = position[:, 0]
+        entities["y"] = position[:, 1]
+        entities["frame"] = [self.frame_id(obj) for obj in objects]
+        order = np.argsort(entities["uid"], kind="stable")
+        return entities[order], [objects[i] for i in order]
+
+    def encode(self, kind, tick, level, surfaces, entities, removed, texts, craters):
+        parts = []
+        if kind == KEYFRAME:
+            level = level.encode()
+            parts += [LEVEL.pack(len(level)), level]
+        for frame, key in surfaces:
+            key = json.dumps(key).encode()
+            parts += [SURFACE.pack(frame, len(key)), key]
+        parts += [entities.tobytes(), removed.astype(UID).tobytes()]
+        for uid, font, text in texts:
+            text = text.encode()
+            parts += [TEXT.pack(uid, font, len(text)), text]
+        parts.append(craters.tobytes())
+        body = b"".join(parts)
+        return HEADER.pack(HEADER.size - 4 + len(body), kind, tick, len(surfaces), len(entities), len(removed),
+                           len(texts), len(craters)) + body
+
+    def publish(self, game):
+        """Send the state of game after its last step to every viewer."""
+        self.accept()
+        if not self.viewers:
+            # Nobody got the previous ticks, whoever connects next starts from a keyframe
+            self.entities = np.zeros(0, ENTITY)
+            self.texts.clear()
+            self.craters.clear()
+            return
+        start = time.perf_counter()
+        entities, objects = self.snapshot(game)
+        previous = self.entities
+        # Entities are new or changed unless the same uid was sent last tick with the same record
+        index = np.minimum(np.searchsorted(previous["uid"], entities["uid"]), max(len(previous) - 1, 0))
+        same = (previous[index] == entities) if len(previous) else np.zeros(len(entities), dtype=bool)
+        changed = entities[~same]
+        removed = np.setdiff1d(previous["uid"], entities["uid"], assume_unique=True)
+        for uid in removed.tolist():
+            self.texts.pop(uid, None)
+            self.craters.pop(uid, None)
+        texts = []
+        all_texts = []
+        craters = []
+        all_craters = []
+        for obj in objects:
+            text = getattr(obj, "text", None)
+            if text is not None:
+                entry = (obj.uid, self.font_id(obj.font), text)
+                all_texts.append(entry)
+                if self.texts.get(obj.uid) != text:
+                    self.texts[obj.uid] = text
+                    texts.append(entry)
+            points = getattr(obj, "craters", None)
+            if points:
+                all_craters += [(obj.uid, x, y) for x, y in points]
+                sent = self.craters.get(obj.uid, 0)
+                if sent < len(points):
+                    craters += [(obj.uid, x, y) for x, y in points[sent:]]
+                    self.craters[obj.uid] = len(points)
+        self.entities = entities
+        delta = self.encode(DELTA, game.ticks, "", self.new_surfaces, changed, removed, texts,
+                            np.array(craters, CRATER))
+        self.new_surfaces = []
+        keyframe = None
+        for viewer in self.viewers:
+            if viewer.needs_keyframe:
+                if keyframe is None:
+                    surfaces = [(frame, key) for key, frame in self.surface_ids.items()]
+                    keyframe = self.encode(KEYFRAME, game.ticks, game.level or "", surfaces, entities,
+                                           np.zeros(0, UID), all_texts, np.array(all_craters, CRATER))
+                    self.keyframes += 1
+                viewer.push(keyframe)
+                viewer.needs_keyframe = False
+            else:
+                viewer.push(delta)
+        row = self.ticks % self.capacity
+        self.encode_times[row] = time.perf_counter() - start
+        self.delta_bytes[row] = len(delta)
+        self.ticks += 1
+        self.send()
+
+    def font_id(self, font):
+        return self.fonts.index(font) if font in self.fonts else 0
+
+    def send(self):
+        connected = []
+        for viewer in self.viewers:
+            try:
+                self.bytes_sent += viewer.flush()
+            except OSError:
+                viewer.sock.close()
+                continue
+            if viewer.queued > self.max_queued:
+                viewer.drop_backlog()
+                self.resyncs += 1
+            connected.append(viewer)
+        self.viewers = connected
+
+    def stats(self, tick_rate):
+        """Encode time per tick in milliseconds and delta bytes per tick over the last ticks, and the bandwidth
+        to each viewer at tick_rate ticks per second."""
+        n = min(self.ticks, self.capacity)
+        stats = {"viewers": len(self.viewers), "ticks": self.ticks, "keyframes": self.keyframes,
+                 "resyncs": self.resyncs, "bytes_sent": self.bytes_sent}
+        if n:
+            ms = self.encode_times[:n] * 1000
+            size = self.delta_bytes[:n]
+            stats.update(encode_ms_mean=round(float(ms.mean()), 4),
+                         encode_ms_p95=round(float(np.percentile(ms, 95)), 4),
+                         encode_ms_max=round(float(ms.max()), 4), delta_bytes_mean=round(float(size.mean()), 1),
+                         delta_bytes_max=int(size.max()),
+                         kbytes_per_second=round(float(size.mean()) * tick_rate / 1024, 2))
+        return stats
+
+    def close(self):
+        for viewer in self.viewers:
+            viewer.sock.close()
+        self.viewers = []
+        self.listener.close()
+        if (self.listener.family == socket.AF_UNIX and os.path.exists(self.address)
+                and stat.S_ISSOCK(os.stat(self.address).st_mode)):
+            os.unlink(self.address)
+
+
+class Message:
+    # A decoded keyframe or delta, entities, removed and craters are NumPy arrays
+    def __init__(self, kind, tick, level, entities, removed, texts, craters):
+        self.keyframe = kind == KEYFRAME
+        self.tick = tick
+        self.level = level
+        self.entities = entities
+        self.removed = removed
+        self.texts = texts
+        self.craters = craters
+
+
+class SpectatorClient:
+    # Receives what a SpectatorServer streams without blocking. The surfaces the server defines are looked up
+    # in the local asset cache, see AssetCache.resolve().
+    def __init__(self, address):
+        family, address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.sock.setblocking(False)
+        self.buffer = bytearray()
+        # Surface id -> surface
+        self.surfaces = {}
+        self.closed = False
+        self.bytes_received = 0
+
+    def receive(self):
+        """Messages that arrived completely since the last call."""
+        while not self.closed:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b""
+            if not data:
+                self.closed = True
+                self.sock.close()
+                break
+            self.buffer += data
+            self.bytes_received += len(data)
+        messages = []
+        offset = 0
+        view = memoryview(self.buffer)
+        while len(view) - offset >= 4:
+            length, = struct.unpack_from("<I", view, offset)
+            if len(view) - offset - 4 < length:
+                break
+            messages.append(self.decode(view, offset))
+            offset += 4 + length
+        view.release()
+        del self.buffer[:offset]
+        return messages
+
+    def decode(self, view, offset):
+        _, kind, tick, surfaces, entities, removed, texts, craters = HEADER.unpack_from(view, offset)
+        offset += HEADER.size
+        level = None
+        if kind == KEYFRAME:
+            length, = LEVEL.unpack_from(view, offset)
+            offset += LEVEL.size
+            level = bytes(view[offset:offset + length]).decode()
+            offset += length
+        for _ in range(surfaces):
+            frame, length = SURFACE.unpack_from(view, offset)
+            offset += SURFACE.size
+            key = as_key(json.loads(bytes(view[offset:offset + length])))
+            offset += length
+            self.surfaces[frame] = assets.resolve(key)
+        entity_array = np.frombuffer(view, ENTITY, entities, offset).copy()
+        offset += entities * ENTITY.itemsize
+        removed_array = np.frombuffer(view, UID, removed, offset).copy()
+        offset += removed * UID.itemsize
+        text_list = []
+        for _ in range(texts):
+            uid, font, length = TEXT.unpack_from(view, offset)
+            offset += TEXT.size
+            text_list.append((uid, font, bytes(view[offset:offset + length]).decode()))
+            offset += length
+        crater_array = np.frombuffer(view, CRATER, craters, offset).copy()
+        return Message(kind, tick, level, entity_array, removed_array, text_list, crater_array)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
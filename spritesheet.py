@@ -4,13 +4,18 @@ import pygame
 from pygame.locals import *
 import numpy as np
 
+from assets import assets
+from entities import detached_rows
+from text import TEXT_COLOR, get_atlas
+
 
 class SpriteSheet:
 
     def __init__(self, filename):
         """Load the sheet."""
+        self.filename = filename
         try:
-            self.sheet = pygame.image.load(filename).convert()
+            self.sheet = assets.load(filename, alpha=False)
         except pygame.error as e:
             print(f"Unable to load spritesheet image: {filename}")
             raise SystemExit(e)
@@ -18,14 +23,7 @@ class SpriteSheet:
     def image_at(self, rectangle, colorkey=None):
         """Load a specific image from a specific rectangle."""
         # Loads image from x, y, x+offset, y+offset.
-        rect = pygame.Rect(rectangle)
-        image = pygame.Surface(rect.size).convert()
-        image.blit(self.sheet, (0, 0), rect)
-        if colorkey is not None:
-            if colorkey is -1:
-                colorkey = image.get_at((0, 0))
-            image.set_colorkey(colorkey, pygame.RLEACCEL)
-        return image
+        return assets.subsurface(self.sheet, self.filename, rectangle, colorkey)
 
     def images_at(self, rects, colorkey=None):
         """Load a whole bunch of images and return them as a list."""
@@ -79,90 +77,149 @@ clock = pygame.time.Clock()
 class Sprite:
     # Image to be supplied if directly supplying Rect instead of Image File
     # Images if we want to store multiple image for 1 sprite
+    # Sprites only have the attributes in __slots__, subclasses list the ones they add in their own. Frames are
+    # shared tuples from the asset cache and no surface is copied per sprite, so a sprite is a few pointers
+    # plus its row in an EntityStore.
+    __slots__ = ("parent", "tag", "store", "slot", "images", "image", "pool", "clip", "uid")
+    # Sprites with cull set are removed by their App once they leave its bounds
+    cull = False
+    # Event types passed to do(), the App only delivers events a sprite subscribed to
+    events = ()
+
     def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None, tag="Sprite", images=None,
                  collision_box_size=None):
-        self.collision_box_size = collision_box_size
         self.parent = None
-        self.size = size
-        self.rect = Rect(pos, (20, 20))
-
-        self.position = np.array(pos, dtype=float)
         self.tag = tag
-        # self.velocity = np.array([1.5, 0.5], dtype=float)
+        # Given by the App every time the sprite is added, so a pooled sprite is a new entity each time
+        self.uid = 0
+        # Pool the sprite is returned to when its App removes it, see pool.py
+        self.pool = None
+        # Clip played by the App's Animator while the sprite is added, see animation.py
+        self.clip = None
+        # Position, velocity and sizes live in a row of an EntityStore and are exposed as properties below.
+        # The row is in detached_rows until the sprite is added to an App, which moves it to its own store.
+        self.store = None
+        self.slot = 0
+        detached_rows.adopt(self)
+        self.set_pos(pos)
+        self.set_size((20, 20))
+        # Velocity is in units per second
         self.velocity = velocity
-        self.angle = 0
-        self.angular_velocity = 0
-        self.color = 'blue'
-        self.speed = [0, 0]
         self.images = None
         if images:
-            self.images = images
-            if self.size:
-                for x in range(len(self.images)):
-                    self.images[x] = pygame.transform.scale(self.images[x], size)
-                self.rect.size = self.images[0].get_size()
+            # Scaled frames are shared through the asset cache, the caller's list is left untouched
+            self.images = assets.frames(images, size)
+            if size:
+                self.set_size(self.images[0].get_size())
             self.image = self.images[0]
-            self.elapsed = pygame.time.get_ticks()
 
         elif image:
             self.image = image
-            if self.size:
-                self.image = pygame.transform.scale(self.image, size)
-                self.rect.size = self.image.get_size()
+            if size:
+                self.image = assets.scale(self.image, size)
+                self.set_size(self.image.get_size())
         elif file:
-            self.image = pygame.image.load(file)
-            if self.size:
-                self.image = pygame.transform.scale(self.image, size)
-                self.rect.size = self.image.get_size()
+            self.image = assets.load(file, size)
+            if size:
+                self.set_size(self.image.get_size())
         else:
             self.image = pygame.Surface(self.rect.size)
-            self.image.fill(self.color)
-        self.image0 = self.image.copy()
-        print(tag, self.images)
-        self.collision_rect = self.rect.copy()
-        if collision_box_size:
-            self.collision_rect.size = collision_box_size
+            self.image.fill('blue')
+        self.store.collision_size[self.slot] = collision_box_size or self.store.size[self.slot]
 
         # print(file, self.image, self.position, self.rect, self.velocity)
 
+    @property
+    def position(self):
+        return self.store.position[self.slot]
+
+    @position.setter
+    def position(self, pos):
+        self.store.position[self.slot] = pos
+
+    @property
+    def previous_position(self):
+        # Position at the previous simulation step, used to interpolate drawing between steps
+        return self.store.previous_position[self.slot]
+
+    @previous_position.setter
+    def previous_position(self, pos):
+        self.store.previous_position[self.slot] = pos
+
+    @property
+    def velocity(self):
+        return self.store.velocity[self.slot]
+
+    @velocity.setter
+    def velocity(self, velocity):
+        self.store.velocity[self.slot] = velocity
+
+    @property
+    def rect(self):
+        rect = Rect((0, 0), self.store.size[self.slot])
+        rect.center = self.store.position[self.slot]
+        return rect
+
+    @property
+    def collision_rect(self):
+        rect = Rect((0, 0), self.store.collision_size[self.slot])
+        rect.center = self.store.position[self.slot]
+        return rect
+
     def set_pos(self, pos):
-        self.position = np.array(pos, dtype=float)
-        self.rect.center = pos
-        self.collision_rect = pos
+        self.position = pos
+        self.previous_position = pos
 
     def get_pos(self):
         return self.position
 
+    def set_size(self, size):
+        self.store.size[self.slot] = size
+
     def set_velocity(self, velocity):
         self.velocity = velocity
 
-    def set_angle(self, angle):
-        self.angle = angle
-        self.image = pygame.transform.rotate(self.image0, self.angle)
-        self.rect.size = self.image.get_size()
-
     def do(self, event):
         pass
 
-    def update(self):
-        self.move()
-
-    def move(self):
-        self.position += self.velocity
-
-        if self.angular_velocity:
-            self.angle += self.angular_velocity
-            self.image = pygame.transform.rotate(self.image0, self.angle)
-            self.rect.size = self.image.get_size()
-
-        self.rect.center = self.position
-        self.collision_rect.center = self.position
-
-    def draw(self, surf):
-        surf.blit(self.image, self.rect)
+    def reset(self, pos):
+        """Prepare a pooled sprite to be added again at pos."""
+        self.set_pos(pos)
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.release(self)
+
+    def on_clip_end(self):
+        """Called when a clip that plays once has shown its last frame."""
+
+    def image_changed(self):
+        # Called after drawing into self.image, the renderer only notices images that are replaced
+        renderer = getattr(self.parent, "renderer", None)
+        if renderer:
+            renderer.redraw(self)
+
+    def update(self, dt):
+        # Sprites added to an App are moved in batch by its EntityStore
+        if self.parent is None or self.parent.store is not self.store:
+            self.move(dt)
+
+    def move(self, dt):
+        # dt is the fixed simulation step in seconds
+        self.previous_position = self.position
+        self.position += self.velocity * dt
+
+    def interpolated_rect(self, alpha=1.0):
+        # alpha is how far the frame being drawn is between the previous and the current simulation step
+        rect = self.rect
+        if alpha < 1.0:
+            rect.center = self.previous_position + (self.position - self.previous_position) * alpha
+        return rect
+
+    def draw(self, surf, alpha=1.0):
+        surf.blit(self.image, self.interpolated_rect(alpha))
         #   Uncomment following code to check custom collision boxes while playing
-        # if self.collision_box_size:
-        #     pygame.draw.rect(surf, (255, 0, 0, 0.5), self.collision_rect)
+        # pygame.draw.rect(surf, (255, 0, 0, 0.5), self.collision_rect)
 
     def distance(self, other):
         distance = self.position - other.position
@@ -177,15 +234,58 @@ class Sprite:
     def __repr__(self):
         return f"{self.tag} Object"
 
+    def __del__(self):
+        # detached_rows does not keep its sprites alive, so their rows are freed here
+        store = getattr(self, "store", None)
+        if store is not None and store.detached:
+            store.release(self.slot)
+
+
+class RotatingSprite(Sprite):
+    # A sprite that turns angular_velocity degrees per second. Its rotated images are cached per whole degree,
+    # only sprites of this class pay for rotation.
+    __slots__ = ("base_image", "angle", "angular_velocity", "rotations")
+
+    def __init__(self, file=None, pos=(0, 0), size=None, velocity=(0, 0), image=None, tag="Sprite", images=None,
+                 collision_box_size=None, angular_velocity=0):
+        super(RotatingSprite, self).__init__(file=file, pos=pos, size=size, velocity=velocity, image=image, tag=tag,
+                                             images=images, collision_box_size=collision_box_size)
+        self.base_image = self.image
+        self.angle = 0
+        self.angular_velocity = angular_velocity
+        self.rotations = {}
+
+    def set_angle(self, angle):
+        self.angle = angle % 360
+        degrees = round(self.angle) % 360
+        image = self.rotations.get(degrees)
+        if image is None:
+            image = self.rotations[degrees] = pygame.transform.rotate(self.base_image, degrees)
+        self.image = image
+        self.set_size(image.get_size())
+
+    def update(self, dt):
+        super(RotatingSprite, self).update(dt)
+        if self.angular_velocity:
+            self.set_angle(self.angle + self.angular_velocity * dt)
+
 
 class SpriteText(Sprite):
-    def __init__(self, text=None, pos=(0, 0), tag="Text", font=None):
+    # Text is put together from the glyphs cached in an atlas of the font, and only when it changes
+    __slots__ = ("font", "atlas", "text")
+
+    def __init__(self, text=None, pos=(0, 0), tag="Text", font=None, color=TEXT_COLOR):
         self.font = font
-        self.position = pos
-        text = font.render(text, False, (0, 222, 0, 0))
-        super(SpriteText, self).__init__(image=text, tag=tag, pos=self.position)
+        self.atlas = get_atlas(font, color)
+        self.text = text
+        super(SpriteText, self).__init__(image=self.atlas.render(text), tag=tag, pos=pos)
         # print(file, self.image, self.position, self.rect, self.velocity)
 
     def update_text(self, new_text):
-        text = self.font.render(new_text, False, (0, 222, 0, 0))
-        self.image = text
+        if new_text == self.text:
+            return
+        self.text = new_text
+        image = self.atlas.render(new_text, self.image)
+        if image is self.image:
+            self.image_changed()
+        self.image = image
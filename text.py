@@ -0,0 +1,85 @@
+import pygame
+
+# Colour of the game's text
+TEXT_COLOR = (0, 222, 0)
+
+# (file, size) -> Font, so every App in the process shares its fonts and their atlases
+fonts = {}
+# (font, color, antialias) -> GlyphAtlas
+atlases = {}
+
+
+def clear():
+    # Fonts do not survive pygame.quit()
+    fonts.clear()
+    atlases.clear()
+
+
+pygame.register_quit(clear)
+
+
+def get_font(file=None, size=28):
+    font = fonts.get((file, size))
+    if font is None:
+        font = fonts[file, size] = pygame.font.Font(file, size)
+    return font
+
+
+def get_atlas(font, color=TEXT_COLOR, antialias=False):
+    key = (font, tuple(color), antialias)
+    atlas = atlases.get(key)
+    if atlas is None:
+        atlas = atlases[key] = GlyphAtlas(font, color, antialias)
+    return atlas
+
+
+class GlyphAtlas:
+    # Rasterizes every glyph of one font and colour once, side by side in a single surface. Strings are put
+    # together by copying glyphs out of it instead of rendering them with the font again.
+    def __init__(self, font, color=TEXT_COLOR, antialias=False):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.height = font.get_height()
+        self.surface = pygame.Surface((256, self.height), pygame.SRCALPHA)
+        # Character -> its rect in surface, the rect's width is also how far the pen advances
+        self.glyphs = {}
+        self.x = 0
+
+    def glyph(self, char):
+        rect = self.glyphs.get(char)
+        if rect is None:
+            rect = self.glyphs[char] = self.add(char)
+        return rect
+
+    def add(self, char):
+        image = self.font.render(char, self.antialias, self.color)
+        width = image.get_width()
+        if self.x + width > self.surface.get_width():
+            surface = pygame.Surface((max(2 * self.surface.get_width(), self.x + width), self.height), pygame.SRCALPHA)
+            surface.blit(self.surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.surface = surface
+        # Antialiased glyphs have per pixel alpha, which is copied as it is instead of blended
+        flags = pygame.BLEND_RGBA_MAX if image.get_flags() & pygame.SRCALPHA else 0
+        self.surface.blit(image, (self.x, 0), special_flags=flags)
+        rect = pygame.Rect(self.x, 0, width, self.height)
+        self.x += width
+        return rect
+
+    def size(self, text):
+        return sum(self.glyph(char).w for char in text), self.height
+
+    def render(self, text, surface=None):
+        """Draw text and return the surface it is in. surface is cleared and drawn into if text fits in it,
+        otherwise a new surface is returned."""
+        width = max(self.size(text)[0], 1)
+        if surface is None or surface.get_width() < width or surface.get_height() != self.height:
+            surface = pygame.Surface((width, self.height), pygame.SRCALPHA)
+        else:
+            surface.fill((0, 0, 0, 0))
+        x = 0
+        for char in text:
+            rect = self.glyphs[char]
+            surface.blit(self.surface, (x, 0), rect, special_flags=pygame.BLEND_RGBA_MAX)
+            x += rect.w
+        return surface
@@ -0,0 +1,68 @@
+import random
+
+
+class Timer:
+    def __init__(self, callback, interval, jitter=0.0, repeat=False):
+        self.callback = callback
+        # Seconds until the timer fires, give or take up to jitter seconds, drawn again every time it is scheduled
+        self.interval = interval
+        self.jitter = jitter
+        self.repeat = repeat
+        # Tick the timer fires on
+        self.due = 0
+        self.active = True
+
+    def cancel(self):
+        # Cancelled timers are dropped when their slot comes round instead of being searched for
+        self.active = False
+
+
+class TimerWheel:
+    # Calls back after a number of seconds of simulated time. Timers are hashed into slots by the tick they are
+    # due on, so each advance() only looks at the timers in one slot. The wheel only moves when advance() is
+    # called, once per simulation step, so paused games and headless runs keep the same timing.
+    def __init__(self, dt, slots=256, rng=None):
+        self.dt = dt
+        self.slots = [[] for _ in range(slots)]
+        self.tick = 0
+        # Draws the jitter, pass the game's own generator to keep it deterministic
+        self.random = rng or random.Random()
+
+    def after(self, delay, callback, jitter=0.0):
+        """Call callback once, delay seconds from now."""
+        return self.schedule(Timer(callback, delay, jitter))
+
+    def every(self, interval, callback, jitter=0.0):
+        """Call callback every interval seconds until the timer is cancelled."""
+        return self.schedule(Timer(callback, interval, jitter, repeat=True))
+
+    def schedule(self, timer):
+        delay = timer.interval
+        if timer.jitter:
+            delay += self.random.uniform(-timer.jitter, timer.jitter)
+        timer.due = self.tick + max(1, round(delay / self.dt))
+        self.slots[timer.due % len(self.slots)].append(timer)
+        return timer
+
+    def advance(self):
+        """Move one tick forward and fire the timers due on it."""
+        self.tick += 1
+        index = self.tick % len(self.slots)
+        slot = self.slots[index]
+        if not slot:
+            return
+        # Timers further than one turn of the wheel away share the slot and stay in it
+        if all(timer.due > self.tick and timer.active for timer in slot):
+            return
+        self.slots[index] = [timer for timer in slot if timer.due > self.tick and timer.active]
+        for timer in slot:
+            if timer.due != self.tick or not timer.active:
+                continue
+            if timer.repeat:
+                self.schedule(timer)
+            else:
+                timer.active = False
+            timer.callback()
+
+    def __len__(self):
+        return sum(timer.active for slot in self.slots for timer in slot)
@@ -0,0 +1,147 @@
+import argparse
+import time
+
+import numpy as np
+import pygame
+
+from main import App, generate_level, HIT_ENEMY, TAGS
+
+# Discrete actions, as (direction key held, fire)
+ACTIONS = ((None, False), (pygame.K_LEFT, False), (pygame.K_RIGHT, False), (None, True), (pygame.K_LEFT, True),
+           (pygame.K_RIGHT, True))
+
+
+class VecEnv:
+    # Steps num_envs independent games in lockstep and returns their observations, rewards and done flags as
+    # arrays. All output arrays are allocated once and overwritten by every step, copy them to keep them.
+    #
+    # observation="state" gives (num_envs, max_entities, 3) float32 rows of (x, y, tag code) read from each game's
+    # EntityStore, tag code 0 marks an empty row, see TAGS for the codes. observation="pixels" gives
+    # (num_envs, width, height, 3) uint8 frames, each drawn into an offscreen surface and read through
+    # pygame.surfarray.pixels3d without going through the display.
+    # The games are built by reset(), which has to be called before the first step().
+    # Rewards are the score of the HIT_ENEMY events of the step, App.step delivers them before it returns. A game
+    # that ends is reset right away, after its last reward was counted.
+    def __init__(self, num_envs, seed=0, observation="state", max_entities=256, frame_skip=1, max_ticks=None):
+        if observation not in ("state", "pixels"):
+            raise ValueError(f"Unknown observation {observation!r}")
+        self.num_envs = num_envs
+        self.seed = seed
+        self.observation = observation
+        self.max_entities = max_entities
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        self.games = [None] * num_envs
+        self.held = [None] * num_envs
+        # Games started, game i is played with seed + the number started before it, and episodes that ended
+        self.episodes = 0
+        self.finished = 0
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.dones = np.zeros(num_envs, dtype=bool)
+        self.action_space = len(ACTIONS)
+        self.num_tags = len(TAGS)
+        # Allocated by the first reset(), pixel observations need the size of the games
+        self.observations = None
+
+    def reset_env(self, i):
+        game = App(headless=True, offscreen=self.observation == "pixels", seed=self.seed + self.episodes)
+        self.episodes += 1
+        generate_level(game)
+        game.events.subscribe(HIT_ENEMY, lambda event: self.add_reward(i, event.score))
+        self.games[i] = game
+        self.held[i] = None
+
+    def add_reward(self, i, score):
+        self.rewards[i] += score
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_env(i)
+        if self.observations is None:
+            if self.observation == "state":
+                self.observations = np.zeros((self.num_envs, self.max_entities, 3), dtype=np.float32)
+            else:
+                width, height = self.games[0].size
+                self.observations = np.zeros((self.num_envs, width, height, 3), dtype=np.uint8)
+        for i in range(self.num_envs):
+            self.observe(i)
+        return self.observations
+
+    def inputs(self, i, action):
+        direction, fire = ACTIONS[action]
+        inputs = []
+        if direction != self.held[i]:
+            if self.held[i] is not None:
+                inputs.append(pygame.event.Event(pygame.KEYUP, key=self.held[i]))
+            if direction is not None:
+                inputs.append(pygame.event.Event(pygame.KEYDOWN, key=direction))
+            self.held[i] = direction
+        if fire:
+            inputs.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE))
+        return inputs
+
+    def done(self, game):
+        return (game.game_over or game.level_cleared()
+                or (self.max_ticks is not None and game.ticks >= self.max_ticks))
+
+    def step(self, actions):
+        """Advance every game by frame_skip ticks with its action and return (observations, rewards, dones)."""
+        if self.observations is None:
+            raise RuntimeError("reset() has to be called before step()")
+        self.rewards.fill(0)
+        for i, game in enumerate(self.games):
+            inputs = self.inputs(i, actions[i])
+            for _ in range(self.frame_skip):
+                game.step(inputs)
+                inputs = ()
+                if self.done(game):
+                    break
+            self.dones[i] = self.done(game)
+            if self.dones[i]:
+                self.finished += 1
+                self.reset_env(i)
+            self.observe(i)
+        return self.observations, self.rewards, self.dones
+
+    def observe(self, i):
+        game = self.games[i]
+        out = self.observations[i]
+        if self.observation == "pixels":
+            game.draw()
+            # pixels3d is a view of the surface's own pixels, it has to be released before the next blit
+            pixels = pygame.surfarray.pixels3d(game.screen)
+            np.copyto(out, pixels)
+            del pixels
+            return
+        store = game.store
+        n = min(store.count, self.max_entities)
+        np.copyto(out[:n, :2], store.position[:n])
+        np.multiply(store.tag[:n], store.alive[:n], out=out[:n, 2], casting="unsafe")
+        out[n:] = 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure VecEnv throughput with random actions")
+    parser.add_argument("--envs", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--observation", choices=("state", "pixels"), default="state")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    env = VecEnv(args.envs, seed=args.seed, observation=args.observation)
+    rng = np.random.default_rng(args.seed)
+    actions = np.zeros(args.envs, dtype=int)
+    total_reward = 0.0
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        actions[:] = rng.integers(0, env.action_space, args.envs)
+        observations, rewards, dones = env.step(actions)
+        total_reward += float(rewards.sum())
+    elapsed = time.perf_counter() - start
+    print(f"{args.envs} envs x {args.steps} steps in {elapsed:.2f}s: {args.envs * args.steps / elapsed:.0f} env "
+          f"steps/s, {env.finished} episodes ended, total reward {total_reward:.0f}")
+
+
+if __name__ == "__main__":
+    main()